@@ -3,71 +3,88 @@
 支持：简单问题直接回答、复杂需求触发报告生成、Clarification 交互
 """
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, AsyncGenerator
-import json
-import math
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+import logging
+import os
+import re
 import traceback
 import asyncio
+import threading
+
+import orjson
+import pandas as pd
 
 from ..config import config_manager
 from ..services.agent_events import agent_event_manager, AgentEvent
 
+logger = logging.getLogger(__name__)
+
 
-def _clean_nan(obj):
+def _json_default(obj):
     """
-    递归清理 NaN、Infinity 等不能 JSON 序列化的值
+    orjson 不原生支持的类型兜底（如 pandas.Timestamp、Decimal、pd.NA）
+    NaN / Infinity 由 orjson 在编码时直接输出为 null，无需预先递归清理
     """
-    if obj is None:
+    if obj is pd.NA or obj is pd.NaT:
         return None
-    elif isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-        return obj
-    elif isinstance(obj, dict):
-        return {k: _clean_nan(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [_clean_nan(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(_clean_nan(item) for item in obj)
-    else:
-        return obj
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    if hasattr(obj, "item"):
+        return obj.item()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
 
 
-async def pass_through_events(
-    session_id: str,
-    main_generator: AsyncGenerator[Dict[str, Any], None],
-) -> AsyncGenerator[Dict[str, Any], None]:
-    """
-    直接传递主事件流，不再混入 Agent 事件
-    Agent 事件现在通过独立的 /monitor/{session_id} 端点获取
-    """
-    try:
-        async for event in main_generator:
-            yield event
-    except Exception as e:
-        print(f"[PassThrough] 主生成器错误: {e}")
-        import traceback
-        traceback.print_exc()
-        yield {"type": "error", "message": str(e)}
-    finally:
-        # 清理队列
-        agent_event_manager.remove_queue(session_id)
+# 固定内容的 SSE 帧，模块加载时预编码为 bytes（StreamingResponse 直接发送，无需再序列化/编码）
+_DONE_FRAME = b"data: [DONE]\n\n"
+_HEARTBEAT_FRAME = b'data: {"type":"heartbeat"}\n\n'
+_INTENT_CHAT_FRAME = b'data: {"type":"intent","intent":"chat","message":""}\n\n'
 
 
-def safe_json_dumps(obj, **kwargs):
+# orjson 序列化选项：允许非字符串 key（与 json.dumps 行为一致），直接支持 numpy 类型
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def safe_json_dumps(obj) -> bytes:
     """
     安全的 JSON 序列化，自动处理 NaN 等非法值
+    使用 orjson（C 扩展）序列化，直接输出 UTF-8 bytes，无需 ensure_ascii=False
+    NaN / Infinity 在编码过程中输出为 null，不再对整棵对象树做预拷贝
     """
     try:
-        cleaned = _clean_nan(obj)
-        return json.dumps(cleaned, **kwargs)
+        return orjson.dumps(obj, default=_json_default, option=_ORJSON_OPTIONS)
     except Exception as e:
         print(f"[JSON] 序列化失败: {e}")
         traceback.print_exc()
         # 返回错误 JSON
-        return json.dumps({"type": "error", "error": f"JSON序列化失败: {str(e)}"}, **kwargs)
+        return orjson.dumps({"type": "error", "error": f"JSON序列化失败: {str(e)}"})
+
+
+def sse_frame(obj) -> bytes:
+    """
+    构造一条 SSE data 帧（bytes）
+    StreamingResponse 对 bytes 块不再做 str -> bytes 编码
+    """
+    return b"data: " + safe_json_dumps(obj) + b"\n\n"
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    使用 orjson 渲染的 JSON 响应（可作为路由的 default_response_class）
+    FastAPI 自带的 ORJSONResponse 已弃用，这里沿用本模块的序列化选项
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_json_default, option=_ORJSON_OPTIONS)
+
+
 from ..llm import llm_client
 from ..models.session import session_manager
 from ..services.chat_agent import chat_agent
@@ -78,6 +95,8 @@ router = APIRouter(prefix="/chat", tags=["对话"])
 
 class ChatMessage(BaseModel):
     """聊天消息"""
+    model_config = ConfigDict(frozen=True)
+    
     role: str  # "user" | "assistant" | "system"
     content: str
 
@@ -91,7 +110,9 @@ class ChatRequest(BaseModel):
     # Clarification 相关
     clarification_response: Optional[str] = None  # 用户对 Clarification 的回复
     original_request: Optional[str] = None  # 原始报告需求（当回复 Clarification 时）
-    messages_context: Optional[List[dict]] = None  # LLM 对话上下文（用于恢复 Clarification 会话）
+    # LLM 对话上下文（用于恢复 Clarification 会话）
+    # 原样透传给 center_agent，元素不做逐项 dict 校验（避免对大段上下文深拷贝）
+    messages_context: Optional[List[Any]] = None
     tool_call_id: Optional[str] = None  # Clarification 工具调用 ID
 
 
@@ -140,16 +161,18 @@ async def chat_with_data(request: ChatRequest):
     
     # 流式响应（统一处理）
     async def generate():
+        logger.info("[Chat] 开始流式响应 session=%s", request.session_id)
         try:
             # 检查是否是 Clarification 回复
             if request.clarification_response and request.original_request:
-                print(f"[Chat] Clarification 回复，继续报告生成")
-                print(f"  原始需求: {request.original_request[:50]}...")
-                print(f"  用户回复: {request.clarification_response[:100]}...")
-                print(f"  有 messages_context: {request.messages_context is not None}")
-                print(f"  有 tool_call_id: {request.tool_call_id is not None}")
+                logger.debug(
+                    "[Chat] Clarification 回复，继续报告生成: 原始需求=%.50s 用户回复=%.100s "
+                    "有 messages_context=%s 有 tool_call_id=%s",
+                    request.original_request, request.clarification_response,
+                    request.messages_context is not None, request.tool_call_id is not None,
+                )
                 
-                yield f"data: {safe_json_dumps({'type': 'intent', 'intent': 'report', 'message': '收到您的回复，继续生成报告...'}, ensure_ascii=False)}\n\n"
+                yield sse_frame({'type': 'intent', 'intent': 'report', 'message': '收到您的回复，继续生成报告...'})
                 
                 # 构建 clarification_context
                 clarification_context = {
@@ -166,46 +189,53 @@ async def chat_with_data(request: ChatRequest):
                     clarification_context=clarification_context,
                 )
                 
-                async for event in pass_through_events(session.session_id, main_gen):
-                    event_type = event.get("type", "unknown")
-                    
-                    # agent_event 类型特殊处理
-                    if event_type == "agent_event":
-                        event_json = safe_json_dumps(event, ensure_ascii=False)
-                        yield f"data: {event_json}\n\n"
-                        continue
-                    
-                    print(f"[Chat] 收到事件: {event_type}")
-                    
-                    # 详细日志：complete 事件
-                    if event_type == "complete":
-                        report = event.get("report", {})
-                        print(f"[Chat] 报告完成!")
-                        print(f"  report_id: {report.get('report_id')}")
-                        print(f"  title: {report.get('title')}")
-                        print(f"  sections: {len(report.get('sections', []))}")
-                    
-                    # 如果再次需要 Clarification
-                    if event_type == "clarification":
-                        yield f"data: {safe_json_dumps({'type': 'clarification', 'rewritten_request': event.get('rewritten_request', ''), 'original_intent': event.get('original_intent', ''), 'original_request': request.original_request, 'messages_context': event.get('messages_context'), 'tool_call_id': event.get('tool_call_id')}, ensure_ascii=False)}\n\n"
-                        return
-                    
-                    # 安全序列化并发送
-                    event_json = safe_json_dumps(event, ensure_ascii=False)
-                    print(f"[Chat] 发送事件: {event_type}, 长度: {len(event_json)}")
-                    yield f"data: {event_json}\n\n"
+                try:
+                    async for event in main_gen:
+                        event_type = event.get("type", "unknown")
+                        
+                        # agent_event 类型特殊处理
+                        if event_type == "agent_event":
+                            yield sse_frame(event)
+                            continue
+                        
+                        logger.debug("[Chat] 收到事件: %s", event_type)
+                        
+                        # 详细日志：complete 事件
+                        if event_type == "complete" and logger.isEnabledFor(logging.DEBUG):
+                            report = event.get("report", {})
+                            logger.debug(
+                                "[Chat] 报告完成! report_id=%s title=%s sections=%d",
+                                report.get('report_id'), report.get('title'), len(report.get('sections', [])),
+                            )
+                        
+                        # 如果再次需要 Clarification
+                        if event_type == "clarification":
+                            yield sse_frame({'type': 'clarification', 'rewritten_request': event.get('rewritten_request', ''), 'original_intent': event.get('original_intent', ''), 'original_request': request.original_request, 'messages_context': event.get('messages_context'), 'tool_call_id': event.get('tool_call_id')})
+                            return
+                        
+                        # 安全序列化并发送
+                        frame = sse_frame(event)
+                        logger.debug("[Chat] 发送事件: %s, 长度: %d", event_type, len(frame))
+                        yield frame
+                except Exception as e:
+                    logger.exception("[Chat] 主生成器错误: %s", e)
+                    yield sse_frame({'type': 'error', 'message': str(e)})
+                finally:
+                    # 清理队列和本次会话的 Agent 计数器
+                    agent_event_manager.remove_queue(session.session_id)
+                    agent_event_manager.reset_counters(session.session_id)
                 
-                print(f"[Chat] 发送 [DONE]")
-                yield "data: [DONE]\n\n"
+                logger.debug("[Chat] 发送 [DONE]")
+                yield _DONE_FRAME
                 return
             
             # Step 1: 意图识别
             intent = await identify_intent(request.message, session)
-            print(f"[Chat] 意图识别: {intent}")
+            logger.info("[Chat] 意图识别: %s", intent)
             
             if intent == "report":
                 # 复杂需求 -> 报告生成流程
-                yield f"data: {safe_json_dumps({'type': 'intent', 'intent': 'report', 'message': '检测到报告生成需求，开始规划...'}, ensure_ascii=False)}\n\n"
+                yield sse_frame({'type': 'intent', 'intent': 'report', 'message': '检测到报告生成需求，开始规划...'})
                 
                 # 使用合并事件流
                 main_gen = center_agent.generate_report(
@@ -214,66 +244,75 @@ async def chat_with_data(request: ChatRequest):
                     stream=True,
                 )
                 
-                async for event in pass_through_events(session.session_id, main_gen):
-                    event_type = event.get("type", "unknown")
-                    
-                    # agent_event 类型特殊处理
-                    if event_type == "agent_event":
-                        event_json = safe_json_dumps(event, ensure_ascii=False)
-                        yield f"data: {event_json}\n\n"
-                        continue
-                    
-                    print(f"[Chat] 收到事件: {event_type}")
-                    
-                    # 详细日志：complete 事件
-                    if event_type == "complete":
-                        report = event.get("report", {})
-                        print(f"[Chat] 报告完成!")
-                        print(f"  report_id: {report.get('report_id')}")
-                        print(f"  title: {report.get('title')}")
-                        print(f"  sections: {len(report.get('sections', []))}")
-                    
-                    # 处理 Clarification - 需要用户确认改写后的需求
-                    if event_type == "clarification":
-                        # 传递改写内容和对话上下文，以便前端在确认时带回
-                        clarification_data = {
-                            'type': 'clarification',
-                            'rewritten_request': event.get('rewritten_request', ''),
-                            'original_intent': event.get('original_intent', ''),
-                            'original_request': request.message,
-                            'messages_context': event.get('messages_context'),  # LLM 对话上下文
-                            'tool_call_id': event.get('tool_call_id'),  # 工具调用 ID
-                        }
-                        print(f"[Chat] 发送 Clarification 到前端:")
-                        print(f"  rewritten_request: {clarification_data['rewritten_request'][:100]}...")
-                        print(f"  has messages_context: {clarification_data['messages_context'] is not None}")
-                        print(f"  tool_call_id: {clarification_data['tool_call_id']}")
-                        yield f"data: {safe_json_dumps(clarification_data, ensure_ascii=False)}\n\n"
-                        return  # 等待用户确认
-                    
-                    # 安全序列化并发送
-                    event_json = safe_json_dumps(event, ensure_ascii=False)
-                    print(f"[Chat] 发送事件: {event_type}, 长度: {len(event_json)}")
-                    yield f"data: {event_json}\n\n"
+                try:
+                    async for event in main_gen:
+                        event_type = event.get("type", "unknown")
+                        
+                        # agent_event 类型特殊处理
+                        if event_type == "agent_event":
+                            yield sse_frame(event)
+                            continue
+                        
+                        logger.debug("[Chat] 收到事件: %s", event_type)
+                        
+                        # 详细日志：complete 事件
+                        if event_type == "complete" and logger.isEnabledFor(logging.DEBUG):
+                            report = event.get("report", {})
+                            logger.debug(
+                                "[Chat] 报告完成! report_id=%s title=%s sections=%d",
+                                report.get('report_id'), report.get('title'), len(report.get('sections', [])),
+                            )
+                        
+                        # 处理 Clarification - 需要用户确认改写后的需求
+                        if event_type == "clarification":
+                            # 传递改写内容和对话上下文，以便前端在确认时带回
+                            clarification_data = {
+                                'type': 'clarification',
+                                'rewritten_request': event.get('rewritten_request', ''),
+                                'original_intent': event.get('original_intent', ''),
+                                'original_request': request.message,
+                                'messages_context': event.get('messages_context'),  # LLM 对话上下文
+                                'tool_call_id': event.get('tool_call_id'),  # 工具调用 ID
+                            }
+                            logger.debug(
+                                "[Chat] 发送 Clarification 到前端: rewritten_request=%.100s "
+                                "has messages_context=%s tool_call_id=%s",
+                                clarification_data['rewritten_request'],
+                                clarification_data['messages_context'] is not None,
+                                clarification_data['tool_call_id'],
+                            )
+                            yield sse_frame(clarification_data)
+                            return  # 等待用户确认
+                        
+                        # 安全序列化并发送
+                        frame = sse_frame(event)
+                        logger.debug("[Chat] 发送事件: %s, 长度: %d", event_type, len(frame))
+                        yield frame
+                except Exception as e:
+                    logger.exception("[Chat] 主生成器错误: %s", e)
+                    yield sse_frame({'type': 'error', 'message': str(e)})
+                finally:
+                    # 清理队列和本次会话的 Agent 计数器
+                    agent_event_manager.remove_queue(session.session_id)
+                    agent_event_manager.reset_counters(session.session_id)
             else:
                 # 简单问题 -> 直接对话
-                yield f"data: {safe_json_dumps({'type': 'intent', 'intent': 'chat', 'message': ''}, ensure_ascii=False)}\n\n"
+                yield _INTENT_CHAT_FRAME
                 
                 async for chunk in chat_agent.chat_stream(
                     session=session,
                     user_message=request.message,
                     history=history,
                 ):
-                    yield f"data: {safe_json_dumps(chunk, ensure_ascii=False)}\n\n"
+                    yield sse_frame(chunk)
             
-            print(f"[Chat] 发送 [DONE]")
-            yield "data: [DONE]\n\n"
+            logger.debug("[Chat] 发送 [DONE]")
+            yield _DONE_FRAME
             
         except Exception as e:
-            print(f"[Chat] 错误: {e}")
-            traceback.print_exc()
-            yield f"data: {safe_json_dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
+            logger.exception("[Chat] 错误: %s", e)
+            yield sse_frame({'type': 'error', 'error': str(e)})
+            yield _DONE_FRAME
     
     return StreamingResponse(
         generate(),
@@ -286,65 +325,48 @@ async def chat_with_data(request: ChatRequest):
     )
 
 
-async def identify_intent(message: str, session) -> str:
-    """
-    意图识别：判断是简单问题还是报告生成需求
-    
-    判断标准：
-    1. 用户是否明确要求生成"报告"或"深度分析"？
-    2. 用户的需求是否能用 1-2 条 SQL 解决（如：求平均值、对比差异、查询列表）？
-    3. 用户需求是否涉及多个维度、多个分析步骤？
-    
-    Returns:
-        "chat": 简单问题，直接对话（可通过 SQL 查询解决）
-        "report": 复杂需求，触发报告生成
-    """
-    message_lower = message.lower()
-    
-    # 明确的报告关键词 - 用户明确要求报告
-    explicit_report_keywords = [
-        "报告", "分析报告", "生成报告", "出一份报告", "写一份报告",
-        "深度分析", "全面分析", "详细分析", "整体分析", "综合分析",
-        "多维度分析", "系统分析", "完整分析",
-    ]
-    
-    # 明确要求报告时，直接返回 report
-    for keyword in explicit_report_keywords:
-        if keyword in message_lower:
-            print(f"[意图识别] 匹配报告关键词: {keyword} -> report")
-            return "report"
-    
-    # 简单查询的特征词 - 这些通常只需要 SQL 查询
-    simple_query_patterns = [
-        "查一下", "查询", "看看", "列出", "显示", "告诉我",
-        "是什么", "有哪些", "多少", "几个", "什么是",
-        "平均值", "最大值", "最小值", "总数", "数量",
-        "比较", "差异", "对比一下",  # 简单对比也是查询
-        "非空", "为空", "等于", "大于", "小于",
-    ]
-    
-    # 检查是否包含简单查询特征
-    has_simple_pattern = any(p in message_lower for p in simple_query_patterns)
-    
-    # 如果包含简单查询模式，且不包含复杂分析词，倾向于 chat
-    complex_analysis_words = [
-        "趋势", "发展", "变化规律", "演变", "市场格局",
-        "多角度", "多方面", "全方位", "洞察", "研究",
-    ]
-    has_complex_words = any(w in message_lower for w in complex_analysis_words)
-    
-    if has_simple_pattern and not has_complex_words:
-        print(f"[意图识别] 简单查询模式 -> chat")
-        return "chat"
-    
-    # 对于不确定的情况，使用 LLM 判断
-    try:
-        result = await llm_client.chat(
-            messages=[{
-                "role": "user",
-                "content": f"""判断用户需求是"简单查询"还是"复杂报告"。
+# ========== 意图识别关键词（模块加载时构建一次） ==========
+
+# 明确的报告关键词 - 用户明确要求报告
+_EXPLICIT_REPORT_KEYWORDS = (
+    "报告", "分析报告", "生成报告", "出一份报告", "写一份报告",
+    "深度分析", "全面分析", "详细分析", "整体分析", "综合分析",
+    "多维度分析", "系统分析", "完整分析",
+)
 
-用户消息：{message}
+# 简单查询的特征词 - 这些通常只需要 SQL 查询
+_SIMPLE_QUERY_PATTERNS = (
+    "查一下", "查询", "看看", "列出", "显示", "告诉我",
+    "是什么", "有哪些", "多少", "几个", "什么是",
+    "平均值", "最大值", "最小值", "总数", "数量",
+    "比较", "差异", "对比一下",  # 简单对比也是查询
+    "非空", "为空", "等于", "大于", "小于",
+)
+
+# 复杂分析词 - 出现时即使有简单查询特征也不直接判定为 chat
+_COMPLEX_ANALYSIS_WORDS = (
+    "趋势", "发展", "变化规律", "演变", "市场格局",
+    "多角度", "多方面", "全方位", "洞察", "研究",
+)
+
+# 每类关键词编译为一个正则（按长度降序，保证长词优先），一次 C 级扫描完成匹配
+def _compile_keywords(keywords) -> "re.Pattern[str]":
+    return re.compile("|".join(map(re.escape, sorted(keywords, key=len, reverse=True))))
+
+
+_RE_EXPLICIT_REPORT = _compile_keywords(_EXPLICIT_REPORT_KEYWORDS)
+_RE_SIMPLE_QUERY = _compile_keywords(_SIMPLE_QUERY_PATTERNS)
+_RE_COMPLEX_ANALYSIS = _compile_keywords(_COMPLEX_ANALYSIS_WORDS)
+
+# 意图识别结果缓存：规范化后的消息 -> "chat" / "report"
+# 命中时直接返回，跳过关键词匹配和 LLM 调用（LRU，有上限）
+_INTENT_CACHE_MAX_SIZE = 4096
+_intent_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+# LLM 意图判断的固定提示词（system 消息）
+# 用户消息单独作为 user 消息发送，使请求前缀保持不变，便于服务端前缀缓存（如百炼隐式缓存）命中
+_INTENT_SYSTEM_PROMPT = """判断用户需求是"简单查询"还是"复杂报告"。
 
 判断标准：
 - "chat"（简单查询）：能用 1-2 条 SQL 解决的问题
@@ -363,9 +385,112 @@ async def identify_intent(message: str, session) -> str:
   - "全面对比各平台的市场份额" -> report
 
 请只回复 "chat" 或 "report"，不要解释。"""
-            }],
+
+# 意图判断只需输出一个词，限制输出长度
+_INTENT_MAX_TOKENS = 16
+
+# LLM 意图判断的标注记录（JSONL），用于离线训练本地分类器
+# 记录中包含用户消息原文（截断到 _INTENT_LABEL_MAX_CHARS 字符）。保留策略：
+# 文件超过 _INTENT_LABELS_MAX_BYTES 时轮转为 intent_labels.jsonl.1（覆盖上一份），
+# 磁盘上最多保留当前文件与上一份，更早的记录直接丢弃
+_INTENT_LABELS_FILE = Path(__file__).resolve().parents[3] / "data" / "intent_labels.jsonl"
+_INTENT_LABELS_MAX_BYTES = 5 * 1024 * 1024
+_INTENT_LABEL_MAX_CHARS = 500
+_intent_labels_lock = threading.Lock()
+
+
+def _intent_cache_key(message: str) -> str:
+    """规范化消息（小写 + 合并空白），作为意图缓存的 key"""
+    return " ".join(message.lower().split())
+
+
+def _cache_intent(key: str, intent: str) -> str:
+    """写入意图缓存并返回 intent，超出上限时淘汰最久未使用的条目"""
+    _intent_cache[key] = intent
+    _intent_cache.move_to_end(key)
+    if len(_intent_cache) > _INTENT_CACHE_MAX_SIZE:
+        _intent_cache.popitem(last=False)
+    return intent
+
+
+def _record_intent_label(message: str, intent: str):
+    """
+    记录 LLM 的意图判断结果，作为离线训练本地意图分类器的标注数据
+    写入失败不影响意图识别（在线程中调用，同步阻塞 IO）
+    """
+    line = orjson.dumps({
+        "message": message[:_INTENT_LABEL_MAX_CHARS],
+        "intent": intent,
+        "created_at": datetime.now().isoformat(),
+    }) + b"\n"
+    try:
+        with _intent_labels_lock:
+            with open(_INTENT_LABELS_FILE, "ab") as f:
+                f.write(line)
+                size = f.tell()
+            if size > _INTENT_LABELS_MAX_BYTES:
+                os.replace(_INTENT_LABELS_FILE, _INTENT_LABELS_FILE.with_name(_INTENT_LABELS_FILE.name + ".1"))
+    except Exception as e:
+        logger.warning("[意图识别] 记录标注失败: %s", e)
+
+
+def _match_intent_keywords(message_lower: str) -> Optional[str]:
+    """
+    关键词快速判断（纯同步、无 IO），无法判断时返回 None，交由 LLM 判断
+    """
+    # 明确要求报告时，直接返回 report
+    match = _RE_EXPLICIT_REPORT.search(message_lower)
+    if match:
+        print(f"[意图识别] 匹配报告关键词: {match.group(0)} -> report")
+        return "report"
+    
+    # 检查是否包含简单查询特征
+    has_simple_pattern = _RE_SIMPLE_QUERY.search(message_lower) is not None
+    
+    # 如果包含简单查询模式，且不包含复杂分析词，倾向于 chat（无简单特征时不必再扫描复杂词）
+    has_complex_words = has_simple_pattern and _RE_COMPLEX_ANALYSIS.search(message_lower) is not None
+    
+    if has_simple_pattern and not has_complex_words:
+        print(f"[意图识别] 简单查询模式 -> chat")
+        return "chat"
+    
+    return None
+
+
+async def identify_intent(message: str, session) -> str:
+    """
+    意图识别：判断是简单问题还是报告生成需求
+    
+    判断标准：
+    1. 用户是否明确要求生成"报告"或"深度分析"？
+    2. 用户的需求是否能用 1-2 条 SQL 解决（如：求平均值、对比差异、查询列表）？
+    3. 用户需求是否涉及多个维度、多个分析步骤？
+    
+    Returns:
+        "chat": 简单问题，直接对话（可通过 SQL 查询解决）
+        "report": 复杂需求，触发报告生成
+    """
+    cache_key = _intent_cache_key(message)
+    cached = _intent_cache.get(cache_key)
+    if cached is not None:
+        _intent_cache.move_to_end(cache_key)
+        logger.debug("[意图识别] 命中缓存 -> %s", cached)
+        return cached
+    
+    keyword_intent = _match_intent_keywords(message.lower())
+    if keyword_intent is not None:
+        return _cache_intent(cache_key, keyword_intent)
+    
+    # 对于不确定的情况，使用 LLM 判断
+    try:
+        result = await llm_client.chat(
+            messages=[
+                {"role": "system", "content": _INTENT_SYSTEM_PROMPT},
+                {"role": "user", "content": message},
+            ],
             agent_name="router",
             stream=False,
+            max_tokens=_INTENT_MAX_TOKENS,
         )
         
         intent = result.get("content", "").strip().lower()
@@ -373,15 +498,14 @@ async def identify_intent(message: str, session) -> str:
         if "<think>" in intent:
             intent = intent.split("</think>")[-1].strip()
         
-        if "report" in intent:
-            print(f"[意图识别] LLM 判断 -> report")
-            return "report"
-        print(f"[意图识别] LLM 判断 -> chat")
-        return "chat"
+        intent = "report" if "report" in intent else "chat"
+        print(f"[意图识别] LLM 判断 -> {intent}")
+        await asyncio.to_thread(_record_intent_label, message, intent)
+        return _cache_intent(cache_key, intent)
         
     except Exception as e:
         print(f"[意图识别] LLM 调用失败: {e}")
-        # 默认为简单对话
+        # 默认为简单对话（不写入缓存，下次仍尝试 LLM 判断）
         return "chat"
 
 
@@ -447,10 +571,10 @@ async def simple_chat(request: SimpleChatRequest):
                     agent_name=request.agent,
                     stream=True,
                 ):
-                    yield f"data: {safe_json_dumps({'content': chunk})}\n\n"
-                yield "data: [DONE]\n\n"
+                    yield sse_frame({'content': chunk})
+                yield _DONE_FRAME
             except Exception as e:
-                yield f"data: {safe_json_dumps({'error': str(e)})}\n\n"
+                yield sse_frame({'error': str(e)})
         
         return StreamingResponse(
             generate(),
@@ -479,6 +603,10 @@ async def simple_chat(request: SimpleChatRequest):
 
 # ========== 独立监控 API ==========
 
+# 监控流心跳间隔（秒）
+_MONITOR_HEARTBEAT_INTERVAL = 3.0
+
+
 @router.get("/monitor/{session_id}")
 async def monitor_stream(session_id: str):
     """
@@ -487,31 +615,45 @@ async def monitor_stream(session_id: str):
     """
     async def generate():
         queue = agent_event_manager.get_queue(session_id)
+        loop = asyncio.get_running_loop()
+        last_sent = loop.time()
         
         try:
             while True:
+                # 距上次发送满 _MONITOR_HEARTBEAT_INTERVAL 仍无事件时发心跳
+                timeout = max(0.0, _MONITOR_HEARTBEAT_INTERVAL - (loop.time() - last_sent))
                 try:
-                    # 等待事件，超时发心跳
-                    event = await asyncio.wait_for(queue.get(), timeout=3.0)
-                    
-                    if event is None:
-                        # 结束信号
-                        break
-                    
-                    if isinstance(event, AgentEvent):
-                        event_data = _clean_nan(event.to_dict())
-                        yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-                    
+                    event = await asyncio.wait_for(queue.get(), timeout=timeout)
                 except asyncio.TimeoutError:
-                    # 心跳
-                    yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+                    agent_event_manager.touch_queue(session_id)
+                    yield _HEARTBEAT_FRAME
+                    last_sent = loop.time()
+                    continue
+                
+                # 取出队列中已就绪的其余事件，合并为一次写出
+                events = [event]
+                while event is not None:
+                    try:
+                        event = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    events.append(event)
+                
+                frames = [sse_frame(e.to_dict()) for e in events if isinstance(e, AgentEvent)]
+                if frames:
+                    yield b"".join(frames)
+                    last_sent = loop.time()
+                
+                if events[-1] is None:
+                    # 结束信号
+                    break
                     
         except asyncio.CancelledError:
             pass
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield sse_frame({'type': 'error', 'message': str(e)})
         finally:
-            yield "data: [DONE]\n\n"
+            yield _DONE_FRAME
     
     return StreamingResponse(
         generate(),
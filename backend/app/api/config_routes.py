@@ -30,6 +30,8 @@ class TestConnectionResponse(BaseModel):
 @router.get("", summary="获取当前配置")
 async def get_config() -> Dict[str, Any]:
     """获取当前 LLM 配置"""
+    # 配置文件可能被手动修改，未变化时只做一次 stat
+    config_manager.reload_if_changed()
     settings = config_manager.llm_settings
     # 隐藏 API Key 的中间部分
     masked_key = ""
@@ -2,12 +2,18 @@
 文件上传 API 路由
 """
 import os
-import shutil
+import sys
 import time
+import asyncio
 import logging
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import Dict, List, Optional
 from datetime import datetime
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
+import aiofiles
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from ..models.session import (
@@ -19,12 +25,44 @@ from ..models.session import (
 )
 from ..services.data_parser import DataParser
 from ..services.knowledge_builder import knowledge_builder
+from ..config import config_manager
+from .chat_routes import ORJSONResponse, sse_frame
+
+_DONE_FRAME = b"data: [DONE]\n\n"
+_HEARTBEAT_FRAME = b'data: {"type":"heartbeat"}\n\n'
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("file_processor")
 
-router = APIRouter()
+# 响应统一用 orjson 渲染（状态 / 日志 / 知识库等嵌套结构较大）
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# 上传文件分块写入大小（1 MB）
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 已落盘的上传文件可用 sendfile 零拷贝保存（仅 Linux）
+_USE_SENDFILE = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+# CSV 解析 / 统计为纯 CPU 计算，放到进程池中执行，不占用事件循环，多文件可并行
+# 首次处理文件时才创建，应用退出时由 shutdown_process_pool 关闭
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """获取（按需创建）CSV 解析进程池"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _process_pool
+
+
+def shutdown_process_pool():
+    """关闭进程池并取消排队中的任务（应用退出时调用）"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
 
 
 class UploadResponse(BaseModel):
@@ -66,15 +104,21 @@ class ProgressTracker:
         ("保存结果", 10),
     ]
     
+    # 各步骤开始时的累计进度（前缀和），start_step 直接按下标取值
+    STEPS_CUM_PERCENT = tuple(accumulate((p for _, p in STEPS), initial=0))
+    STEPS_NO_LLM_CUM_PERCENT = tuple(accumulate((p for _, p in STEPS_NO_LLM), initial=0))
+    
     def __init__(self, session_id: str, file_id: str, use_llm: bool = True):
         self.session_id = session_id
         self.file_id = file_id
         self.use_llm = use_llm
         self.steps = self.STEPS if use_llm else self.STEPS_NO_LLM
+        self.cum_percents = self.STEPS_CUM_PERCENT if use_llm else self.STEPS_NO_LLM_CUM_PERCENT
         self.total_steps = len(self.steps)
         self.current_step_idx = 0
         self.start_time = time.time()
-        self.step_start_time = time.time()
+        self.step_start_time = self.start_time
+        self.started_at = datetime.fromtimestamp(self.start_time).isoformat()
         
     def _get_session(self):
         return session_manager.get_session(self.session_id)
@@ -95,6 +139,22 @@ class ProgressTracker:
         if session:
             session_manager.add_file_log(session, self.file_id, message)
     
+    def _update_progress(self, **fields):
+        """原地更新文件的进度对象（日志列表随对象保留，不重新构造 / 校验模型）"""
+        session = self._get_session()
+        if not session:
+            return
+        f = session.files_by_id.get(self.file_id)
+        if f is None:
+            return
+        
+        progress = f.progress
+        if progress is None:
+            progress = ProcessingProgress.model_construct()
+        for name, value in fields.items():
+            setattr(progress, name, value)
+        session_manager.update_file_progress(session, self.file_id, progress)
+    
     def start_step(self, step_name: str = None):
         """开始一个步骤"""
         self.step_start_time = time.time()
@@ -103,9 +163,7 @@ class ProgressTracker:
             step_name = self.steps[self.current_step_idx][0]
         
         # 计算进度百分比
-        percent = 0
-        for i in range(self.current_step_idx):
-            percent += self.steps[i][1]
+        percent = self.cum_percents[min(self.current_step_idx, self.total_steps)]
         
         # 计算预计剩余时间
         elapsed = time.time() - self.start_time
@@ -115,25 +173,15 @@ class ProgressTracker:
             estimated_remaining = int(total_estimated - elapsed)
         
         # 更新进度
-        progress = ProcessingProgress(
+        self._update_progress(
             current_step=step_name,
             step_index=self.current_step_idx + 1,
             total_steps=self.total_steps,
             percent=percent,
-            started_at=datetime.fromtimestamp(self.start_time).isoformat(),
+            started_at=self.started_at,
             estimated_remaining_seconds=estimated_remaining,
-            logs=[]
         )
         
-        session = self._get_session()
-        if session:
-            # 保留现有日志
-            for f in session.files:
-                if f.file_id == self.file_id and f.progress:
-                    progress.logs = f.progress.logs
-                    break
-            session_manager.update_file_progress(session, self.file_id, progress)
-        
         self._log(f"开始: {step_name} (步骤 {self.current_step_idx + 1}/{self.total_steps})")
     
     def complete_step(self):
@@ -153,32 +201,52 @@ class ProgressTracker:
             self._log(f"✗ 处理失败: {error}", "ERROR")
         
         # 更新最终进度
-        progress = ProcessingProgress(
+        self._update_progress(
             current_step="完成" if success else "失败",
             step_index=self.total_steps if success else self.current_step_idx,
             total_steps=self.total_steps,
             percent=100 if success else int((self.current_step_idx / self.total_steps) * 100),
-            started_at=datetime.fromtimestamp(self.start_time).isoformat(),
+            started_at=self.started_at,
             estimated_remaining_seconds=0,
-            logs=[]
         )
-        
-        session = self._get_session()
-        if session:
-            for f in session.files:
-                if f.file_id == self.file_id and f.progress:
-                    progress.logs = f.progress.logs
-                    break
-            session_manager.update_file_progress(session, self.file_id, progress)
 
 
-# 用于跟踪需要取消的任务（在函数定义前声明）
-_cancelled_tasks_internal = set()
+# 每个文件一个取消事件（在函数定义前声明），set 后处理中的任务会立即中断
+_cancel_events: Dict[str, asyncio.Event] = {}
+
+
+def _get_cancel_event(file_id: str) -> asyncio.Event:
+    """获取（或创建）文件的取消事件"""
+    event = _cancel_events.get(file_id)
+    if event is None:
+        event = _cancel_events[file_id] = asyncio.Event()
+    return event
 
 
 def _check_cancelled(file_id: str) -> bool:
     """检查任务是否被取消"""
-    return file_id in _cancelled_tasks_internal
+    event = _cancel_events.get(file_id)
+    return event is not None and event.is_set()
+
+
+async def _run_cancellable(file_id: str, aw):
+    """
+    运行协程 / Future，同时等待取消事件；先被取消则中断任务并抛出 InterruptedError
+    
+    用于 CSV 解析、LLM 调用等耗时步骤，取消无需等到步骤结束才生效
+    """
+    task = asyncio.ensure_future(aw)
+    waiter = asyncio.ensure_future(_get_cancel_event(file_id).wait())
+    try:
+        done, _ = await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+        if not task.done():
+            task.cancel()
+    
+    if task not in done:
+        raise InterruptedError("任务已被用户取消")
+    return task.result()
 
 
 async def process_file_async(
@@ -188,7 +256,12 @@ async def process_file_async(
     file_size: int,
     generate_descriptions: bool = True
 ):
-    """异步处理文件 - 解析并构建知识库"""
+    """
+    异步处理文件 - 解析并构建知识库
+    
+    会话对象只获取一次：SessionManager 的更新方法都是原地修改；
+    处理期间删除文件 / 会话会触发取消事件，不会继续写入已删除的会话
+    """
     session = session_manager.get_session(session_id)
     if not session:
         return
@@ -215,17 +288,21 @@ async def process_file_async(
         # ===== 步骤 2: 解析 CSV 结构 =====
         check_cancelled()
         tracker.start_step()
-        parser = DataParser()
-        parsed_data = parser.parse_csv(file_path)
+        parsed_data = await _run_cancellable(
+            file_id,
+            asyncio.get_running_loop().run_in_executor(
+                _get_process_pool(), DataParser().parse_csv, file_path
+            )
+        )
         
         # 更新文件信息
         file_info = FileInfo(
             file_size_mb=round(file_size_mb, 2),
             row_count=parsed_data["row_count"],
             column_count=parsed_data["column_count"],
-            encoding="UTF-8"  # TODO: 从解析器获取
+            encoding=parsed_data["encoding"].upper(),
+            delimiter=parsed_data["delimiter"],
         )
-        session = session_manager.get_session(session_id)
         session_manager.update_file_info(session, file_id, file_info)
         
         tracker._log(f"行数: {parsed_data['row_count']:,} 行")
@@ -236,8 +313,12 @@ async def process_file_async(
         check_cancelled()
         tracker.start_step()
         columns = parsed_data["columns"]
-        dimension_count = sum(1 for c in columns if c.get("is_dimension"))
-        metric_count = sum(1 for c in columns if c.get("is_metric"))
+        dimension_count = metric_count = 0
+        for c in columns:
+            if c.get("is_dimension"):
+                dimension_count += 1
+            if c.get("is_metric"):
+                metric_count += 1
         tracker._log(f"维度字段: {dimension_count} 个, 指标字段: {metric_count} 个")
         tracker.complete_step()
         
@@ -265,10 +346,13 @@ async def process_file_async(
             tracker._log("正在调用 LLM 生成字段描述...")
             total_columns = len(columns)
             
-            # 构建知识库（包含 LLM 调用）
-            knowledge = await knowledge_builder.build_knowledge_base(
-                parsed_data,
-                generate_descriptions=True
+            # 构建知识库（包含 LLM 调用），期间可被取消
+            knowledge = await _run_cancellable(
+                file_id,
+                knowledge_builder.build_knowledge_base(
+                    parsed_data,
+                    generate_descriptions=True
+                )
             )
             tracker._log(f"已完成 {total_columns} 个字段的描述生成")
             tracker.complete_step()
@@ -277,9 +361,12 @@ async def process_file_async(
             tracker.start_step()
         else:
             # 不使用 LLM
-            knowledge = await knowledge_builder.build_knowledge_base(
-                parsed_data,
-                generate_descriptions=False
+            knowledge = await _run_cancellable(
+                file_id,
+                knowledge_builder.build_knowledge_base(
+                    parsed_data,
+                    generate_descriptions=False
+                )
             )
         
         # ===== 最后步骤: 保存结果 =====
@@ -296,10 +383,11 @@ async def process_file_async(
             statistics=knowledge["statistics"],
             sample_data=knowledge["sample_data"],
             table_description=knowledge.get("table_description"),
+            encoding=parsed_data["encoding"],
+            delimiter=parsed_data["delimiter"],
         )
         
         # 保存知识库
-        session = session_manager.get_session(session_id)
         session_manager.add_table_knowledge(session, table_knowledge)
         
         # 更新文件状态为就绪
@@ -309,15 +397,52 @@ async def process_file_async(
         tracker.finish(success=True)
         
     except Exception as e:
-        # 更新文件状态为错误
+        # 更新文件状态为错误（会话可能已被删除，重新获取，避免把已删除的会话写回磁盘）
         session = session_manager.get_session(session_id)
-        session_manager.update_file_status(session, file_id, "error", str(e))
+        if session:
+            session_manager.update_file_status(session, file_id, "error", str(e))
         tracker.finish(success=False, error=str(e))
         logger.exception(f"处理文件失败 [{file_id}]")
+    finally:
+        _cancel_events.pop(file_id, None)
+
+
+def _sendfile_to_path(src_fd: int, dest_path: str) -> int:
+    """用 sendfile 在内核中把已落盘的临时文件复制到目标路径，返回字节数"""
+    size = os.fstat(src_fd).st_size
+    offset = 0
+    with open(dest_path, "wb") as out:
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    return offset
+
+
+async def _save_upload(file: UploadFile, dest_path) -> int:
+    """保存上传文件，返回文件大小（字节）"""
+    # 大文件已被 SpooledTemporaryFile 转存到磁盘（_rolled），Linux 下直接 sendfile，
+    # 不经过用户态逐块拷贝；放到线程中执行，不阻塞事件循环
+    if _USE_SENDFILE and getattr(file.file, "_rolled", False):
+        try:
+            return await asyncio.to_thread(_sendfile_to_path, file.file.fileno(), str(dest_path))
+        except OSError as e:
+            logger.warning(f"sendfile 保存失败，改用分块写入: {e}")
+            await file.seek(0)
+    
+    # 分块异步读取 / 写入，不阻塞事件循环，多个上传可并发进行
+    file_size = 0
+    async with aiofiles.open(dest_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+            file_size += len(chunk)
+    return file_size
 
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_files(
+    request: Request,
     background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     session_id: Optional[str] = Form(None),
@@ -330,11 +455,16 @@ async def upload_files(
     - 自动创建或使用现有会话
     - 后台异步处理文件并构建知识库
     """
-    # 获取或创建会话
-    session = session_manager.get_or_create_session(session_id)
-    
-    uploaded_files = []
+    # 先整体校验（大小、文件类型），全部通过后才创建会话并写盘，避免留下半成品会话
+    max_upload_bytes = config_manager.app_settings.max_upload_size_mb * 1024 * 1024
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_upload_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"上传内容超过 {config_manager.app_settings.max_upload_size_mb} MB 限制"
+        )
     
+    total_size = 0
     for file in files:
         # 验证文件类型
         if not file.filename.lower().endswith('.csv'):
@@ -342,19 +472,27 @@ async def upload_files(
                 status_code=400, 
                 detail=f"只支持 CSV 文件，{file.filename} 不是有效的 CSV 文件"
             )
-        
+        total_size += file.size or 0
+    if total_size > max_upload_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"上传文件总大小超过 {config_manager.app_settings.max_upload_size_mb} MB 限制"
+        )
+    
+    # 获取或创建会话
+    session = session_manager.get_or_create_session(session_id)
+    
+    uploaded_files = []
+    
+    for file in files:
         # 保存文件
         upload_path = session_manager.get_upload_path(session.session_id, file.filename)
         
         try:
-            with open(upload_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            file_size = await _save_upload(file, upload_path)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"保存文件失败: {e}")
         
-        # 获取文件大小
-        file_size = os.path.getsize(upload_path)
-        
         # 创建初始文件信息
         initial_file_info = FileInfo(
             file_size_mb=round(file_size / (1024 * 1024), 2)
@@ -381,7 +519,8 @@ async def upload_files(
         
         # 添加到会话
         session = session_manager.add_file(session, file_info)
-        uploaded_files.append(file_info.model_dump())
+        # 空字段（如 error_message）不输出，减小响应体
+        uploaded_files.append(file_info.model_dump(exclude_none=True))
         
         # 添加后台处理任务
         background_tasks.add_task(
@@ -403,6 +542,51 @@ async def upload_files(
     )
 
 
+# 上传状态缓存（LRU）: session_id -> ((会话版本号, 文件数), 状态结果)
+# 上限与会话内存缓存一致，超出后淘汰最久未查询的会话
+_status_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_STATUS_CACHE_MAX_SIZE = session_manager.MAX_CACHED_SESSIONS
+
+
+def _file_status(f: UploadedFile) -> dict:
+    """单个文件的处理状态"""
+    return {
+        "file_id": f.file_id,
+        "original_name": f.original_name,
+        "status": f.status,
+        "error_message": f.error_message,
+        "file_info": f.file_info.model_dump() if f.file_info else None,
+        "progress": f.progress.model_dump() if f.progress else None,
+    }
+
+
+def _summarize_files(files: List[UploadedFile], with_details: bool = True):
+    """
+    单次遍历：同时生成文件状态列表与各状态计数
+    
+    Returns:
+        (文件状态列表（with_details=False 时为 None）, 是否全部处理完成, 状态计数)
+    """
+    counts = {"pending": 0, "processing": 0, "ready": 0, "error": 0}
+    all_ready = True
+    files_status = [] if with_details else None
+    for f in files:
+        counts[f.status] = counts.get(f.status, 0) + 1
+        if f.status not in ("ready", "error"):
+            all_ready = False
+        if with_details:
+            files_status.append(_file_status(f))
+    
+    summary = {
+        "total": len(files),
+        "pending": counts["pending"],
+        "processing": counts["processing"],
+        "ready": counts["ready"],
+        "error": counts["error"],
+    }
+    return files_status, all_ready, summary
+
+
 @router.get("/upload/status/{session_id}")
 async def get_upload_status(session_id: str):
     """获取上传文件的处理状态（包含详细进度）"""
@@ -410,37 +594,95 @@ async def get_upload_status(session_id: str):
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    files_status = []
-    for f in session.files:
-        file_status = {
-            "file_id": f.file_id,
-            "original_name": f.original_name,
-            "status": f.status,
-            "error_message": f.error_message,
-            "file_info": f.file_info.model_dump() if f.file_info else None,
-            "progress": f.progress.model_dump() if f.progress else None,
-        }
-        files_status.append(file_status)
-    
-    # 检查是否所有文件都已处理完成
-    all_ready = all(f.status in ["ready", "error"] for f in session.files)
-    processing_count = sum(1 for f in session.files if f.status == "processing")
-    ready_count = sum(1 for f in session.files if f.status == "ready")
-    error_count = sum(1 for f in session.files if f.status == "error")
-    pending_count = sum(1 for f in session.files if f.status == "pending")
+    # 前端轮询频繁：会话未更新（版本号与文件数不变）时直接返回上次的结果
+    key = (session.version, len(session.files))
+    cached = _status_cache.get(session_id)
+    if cached and cached[0] == key:
+        _status_cache.move_to_end(session_id)
+        return cached[1]
     
-    return {
+    files_status, all_ready, summary = _summarize_files(session.files)
+    result = {
         "session_id": session_id,
         "files": files_status,
         "all_ready": all_ready,
-        "summary": {
-            "total": len(session.files),
-            "pending": pending_count,
-            "processing": processing_count,
-            "ready": ready_count,
-            "error": error_count,
-        }
+        "summary": summary,
     }
+    _status_cache[session_id] = (key, result)
+    _status_cache.move_to_end(session_id)
+    while len(_status_cache) > _STATUS_CACHE_MAX_SIZE:
+        _status_cache.popitem(last=False)
+    return result
+
+
+# 状态流无变化时的心跳间隔（秒）
+UPLOAD_STREAM_HEARTBEAT_INTERVAL = 15.0
+
+
+@router.get("/upload/stream/{session_id}")
+async def stream_upload_status(session_id: str):
+    """
+    以 SSE 推送上传文件的处理状态（替代轮询 /upload/status）
+    
+    - 连接后先推送一次完整状态（type=status，与 /upload/status 结构相同）
+    - 之后仅在文件状态 / 进度变化时推送变化的文件（type=files，removed 为已删除的文件）
+    - 所有文件处理完成后结束
+    """
+    if not session_manager.get_session(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    
+    async def event_stream():
+        queue = session_manager.subscribe(session_id)
+        try:
+            initial = await get_upload_status(session_id)
+            yield sse_frame({"type": "status", **initial})
+            all_ready = initial["all_ready"]
+            
+            while not all_ready:
+                try:
+                    changed = {await asyncio.wait_for(queue.get(), UPLOAD_STREAM_HEARTBEAT_INTERVAL)}
+                except asyncio.TimeoutError:
+                    yield _HEARTBEAT_FRAME
+                    continue
+                # 合并已积压的变化，一次推送
+                while not queue.empty():
+                    changed.add(queue.get_nowait())
+                
+                # None：会话已被删除
+                session = None if None in changed else session_manager.get_session(session_id)
+                if not session:
+                    break
+                
+                files, removed = [], []
+                for file_id in changed:
+                    f = session.files_by_id.get(file_id)
+                    if f is None:
+                        removed.append(file_id)
+                    else:
+                        files.append(_file_status(f))
+                _, all_ready, summary = _summarize_files(session.files, with_details=False)
+                yield sse_frame({
+                    "type": "files",
+                    "session_id": session_id,
+                    "files": files,
+                    "removed": removed,
+                    "all_ready": all_ready,
+                    "summary": summary,
+                })
+            
+            yield _DONE_FRAME
+        finally:
+            session_manager.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        }
+    )
 
 
 @router.get("/upload/logs/{session_id}/{file_id}")
@@ -450,16 +692,16 @@ async def get_file_logs(session_id: str, file_id: str):
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    for f in session.files:
-        if f.file_id == file_id:
-            return {
-                "file_id": file_id,
-                "original_name": f.original_name,
-                "status": f.status,
-                "logs": f.progress.logs if f.progress else [],
-            }
+    f = session.files_by_id.get(file_id)
+    if not f:
+        raise HTTPException(status_code=404, detail="文件不存在")
     
-    raise HTTPException(status_code=404, detail="文件不存在")
+    return {
+        "file_id": file_id,
+        "original_name": f.original_name,
+        "status": f.status,
+        "logs": list(f.progress.logs) if f.progress else [],
+    }
 
 
 @router.get("/knowledge/{session_id}", response_model=KnowledgeResponse)
@@ -485,20 +727,21 @@ async def get_table_detail(session_id: str, table_id: str):
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    for table in session.tables:
-        if table.table_id == table_id:
-            return {
-                "success": True,
-                "table": table.model_dump(),
-            }
+    table = session.tables_by_id.get(table_id)
+    if not table:
+        raise HTTPException(status_code=404, detail="数据表不存在")
     
-    raise HTTPException(status_code=404, detail="数据表不存在")
+    return {
+        "success": True,
+        "table": table.model_dump(),
+    }
 
 
 @router.get("/sessions")
 async def list_sessions():
     """列出所有会话"""
-    sessions = session_manager.list_sessions()
+    # 首次调用可能需要扫描会话文件重建索引，放到线程中执行
+    sessions = await asyncio.to_thread(session_manager.list_sessions)
     return {
         "success": True,
         "sessions": sessions,
@@ -523,17 +766,17 @@ async def get_session_detail(session_id: str):
 
 def is_task_cancelled(file_id: str) -> bool:
     """检查任务是否被取消"""
-    return file_id in _cancelled_tasks_internal
+    return _check_cancelled(file_id)
 
 
 def mark_task_cancelled(file_id: str):
-    """标记任务为取消"""
-    _cancelled_tasks_internal.add(file_id)
+    """标记任务为取消（唤醒正在等待的处理任务）"""
+    _get_cancel_event(file_id).set()
 
 
 def clear_cancelled_mark(file_id: str):
     """清除取消标记"""
-    _cancelled_tasks_internal.discard(file_id)
+    _cancel_events.pop(file_id, None)
 
 
 @router.delete("/file/{session_id}/{file_id}")
@@ -544,24 +787,20 @@ async def delete_file(session_id: str, file_id: str):
         raise HTTPException(status_code=404, detail="会话不存在")
     
     # 查找文件
-    file_found = False
-    for f in session.files:
-        if f.file_id == file_id:
-            file_found = True
-            # 如果正在处理，标记为取消
-            if f.status == "processing":
-                mark_task_cancelled(file_id)
-            break
-    
-    if not file_found:
+    f = session.files_by_id.get(file_id)
+    if not f:
         raise HTTPException(status_code=404, detail="文件不存在")
     
+    # 如果正在处理，标记为取消
+    if f.status == "processing":
+        mark_task_cancelled(file_id)
+    
     # 删除文件记录
     session_manager.delete_file(session, file_id)
     
     # 同时删除关联的表
     session = session_manager.get_session(session_id)
-    tables_to_delete = [t.table_id for t in session.tables if t.file_id == file_id]
+    tables_to_delete = [t.table_id for t in session.tables_by_file_id.get(file_id, [])]
     for table_id in tables_to_delete:
         session_manager.delete_table(session, table_id)
     
@@ -582,13 +821,7 @@ async def delete_table(session_id: str, table_id: str):
         raise HTTPException(status_code=404, detail="会话不存在")
     
     # 查找表
-    table_found = False
-    for t in session.tables:
-        if t.table_id == table_id:
-            table_found = True
-            break
-    
-    if not table_found:
+    if table_id not in session.tables_by_id:
         raise HTTPException(status_code=404, detail="表不存在")
     
     session_manager.delete_table(session, table_id)
@@ -605,22 +838,22 @@ async def cancel_processing(session_id: str, file_id: str):
         raise HTTPException(status_code=404, detail="会话不存在")
     
     # 查找文件
-    for f in session.files:
-        if f.file_id == file_id:
-            if f.status != "processing":
-                return {"success": False, "message": "文件未在处理中"}
-            
-            # 标记为取消
-            mark_task_cancelled(file_id)
-            
-            # 更新状态为已取消
-            session_manager.update_file_status(session, file_id, "error", "用户取消")
-            session_manager.add_file_log(session, file_id, "⚠️ 处理已被用户取消")
-            
-            logger.info(f"已取消处理: {file_id}")
-            return {"success": True, "message": "处理已取消"}
+    f = session.files_by_id.get(file_id)
+    if not f:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    
+    if f.status != "processing":
+        return {"success": False, "message": "文件未在处理中"}
+    
+    # 标记为取消
+    mark_task_cancelled(file_id)
+    
+    # 更新状态为已取消
+    session_manager.update_file_status(session, file_id, "error", "用户取消")
+    session_manager.add_file_log(session, file_id, "⚠️ 处理已被用户取消")
     
-    raise HTTPException(status_code=404, detail="文件不存在")
+    logger.info(f"已取消处理: {file_id}")
+    return {"success": True, "message": "处理已取消"}
 
 
 @router.delete("/session/{session_id}/clear")
@@ -654,6 +887,7 @@ async def delete_session(session_id: str):
             mark_task_cancelled(f.file_id)
     
     success = session_manager.delete_session(session_id)
+    _status_cache.pop(session_id, None)
     
     if success:
         logger.info(f"已删除会话: {session_id}")
@@ -2,10 +2,12 @@
 配置管理模块
 支持 LLM 配置的持久化存储和动态更新
 """
-import json
 import os
+import threading
+import orjson
 from pathlib import Path
-from typing import Optional, Dict, Any
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Mapping
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
@@ -51,6 +53,14 @@ class AppSettings(BaseSettings):
     debug: bool = True
     data_dir: str = "../data"  # 相对于 backend 目录
     config_file: str = "../data/config.json"
+    max_upload_size_mb: int = 500  # 单次上传的最大总大小
+    session_pretty: bool = False  # 会话文件是否缩进输出（便于调试查看，默认紧凑格式）
+    # CORS 允许的来源（环境变量 DEEPRESEARCH_ALLOWED_ORIGINS 可用 JSON 数组覆盖）
+    # 请求携带凭据，不允许 "null"（file:// 页面、沙箱 iframe 等均发送 Origin: null）；
+    # 前端需通过本机开发服务器访问，由下面的正则放行
+    allowed_origins: List[str] = []
+    # 本机任意端口的开发服务器
+    allowed_origin_regex: Optional[str] = r"https?://(localhost|127\.0\.0\.1)(:\d+)?"
     
     class Config:
         env_prefix = "DEEPRESEARCH_"
@@ -60,21 +70,33 @@ class ConfigManager:
     """配置管理器 - 负责配置的加载、保存和获取"""
     
     _instance: Optional["ConfigManager"] = None
+    _instance_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialized = False
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._initialized = False
+                    cls._instance = instance
         return cls._instance
     
     def __init__(self):
         if self._initialized:
             return
-        self._initialized = True
-        self.app_settings = AppSettings()
-        self.llm_settings: Optional[LLMSettings] = None
-        self._ensure_data_dir()
-        self._load_config()
+        with self._instance_lock:
+            # 加锁后再检查一次，避免多个线程同时初始化
+            if self._initialized:
+                return
+            self.app_settings = AppSettings()
+            self.llm_settings: Optional[LLMSettings] = None
+            self._agent_cache: Dict[str, Mapping[str, Any]] = {}
+            self._config_mtime: Optional[int] = None  # 最近一次加载 / 保存时配置文件的 mtime (ns)
+            # 配置版本号，每次加载 / 更新配置时递增，供调用方判断缓存是否失效
+            self.generation = 0
+            self._ensure_data_dir()
+            self._load_config()
+            self._initialized = True
     
     def _ensure_data_dir(self):
         """确保数据目录存在"""
@@ -85,28 +107,67 @@ class ConfigManager:
         config_path = Path(self.app_settings.config_file)
         if config_path.exists():
             try:
-                with open(config_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+                self._config_mtime = config_path.stat().st_mtime_ns
+                data = orjson.loads(config_path.read_bytes())
                 self.llm_settings = LLMSettings(**data)
             except Exception as e:
                 print(f"加载配置失败: {e}, 使用默认配置")
                 self.llm_settings = LLMSettings()
         else:
             self.llm_settings = LLMSettings()
+        self._rebuild_agent_cache()
+        self.generation += 1
     
     def save_config(self):
         """保存配置到文件"""
         config_path = Path(self.app_settings.config_file)
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(self.llm_settings.model_dump(), f, ensure_ascii=False, indent=2)
+        # 先写临时文件再原子替换，写入中途崩溃或并发读取都不会看到半截 JSON
+        tmp_path = config_path.with_suffix(".json.tmp")
+        tmp_path.write_bytes(
+            orjson.dumps(self.llm_settings.model_dump(), option=orjson.OPT_INDENT_2)
+        )
+        os.replace(tmp_path, config_path)
+        self._config_mtime = config_path.stat().st_mtime_ns
+    
+    def reload_if_changed(self) -> bool:
+        """配置文件在外部被修改（mtime 变化）时重新加载，返回是否重新加载"""
+        config_path = Path(self.app_settings.config_file)
+        try:
+            mtime = config_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._config_mtime:
+            return False
+        self._load_config()
+        return True
     
     def update_llm_settings(self, settings: LLMSettings):
         """更新 LLM 配置"""
         self.llm_settings = settings
+        self._rebuild_agent_cache()
+        self.generation += 1
         self.save_config()
     
-    def get_agent_config(self, agent_name: str) -> Dict[str, Any]:
-        """获取指定 Agent 的完整配置（合并默认配置）"""
+    def _rebuild_agent_cache(self):
+        """预先合并所有 Agent 的配置（配置变更时重建）"""
+        self._agent_cache = {
+            name: self._build_agent_config(name)
+            for name in self.llm_settings.agents
+        }
+    
+    def get_agent_config(self, agent_name: str) -> Mapping[str, Any]:
+        """
+        获取指定 Agent 的完整配置（合并默认配置）
+        
+        返回缓存的只读映射；需要覆盖参数时请复制: {**config, **overrides}
+        """
+        merged = self._agent_cache.get(agent_name)
+        if merged is None:
+            merged = self._agent_cache[agent_name] = self._build_agent_config(agent_name)
+        return merged
+    
+    def _build_agent_config(self, agent_name: str) -> Mapping[str, Any]:
+        """合并默认配置与 Agent 配置"""
         default = self.llm_settings.default.model_dump()
         agent = self.llm_settings.agents.get(agent_name, AgentConfig()).model_dump()
         
@@ -116,7 +177,7 @@ class ConfigManager:
             if value is not None:
                 merged[key] = value
         
-        return merged
+        return MappingProxyType(merged)
     
     def get_llm_client_config(self) -> Dict[str, str]:
         """获取 LLM 客户端配置"""
@@ -3,9 +3,17 @@ LLM 客户端封装
 基于 OpenAI SDK 调用阿里云百炼 API
 """
 import json
+import time
+import random
 import asyncio
-from typing import List, Dict, Any, Optional, AsyncGenerator, Union, Callable, Awaitable
-from openai import AsyncOpenAI, APIError, RateLimitError, APIConnectionError
+import hashlib
+import importlib.util
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, AsyncGenerator, Union, Callable, Awaitable, Tuple, Mapping
+import httpx
+import orjson
+from openai import AsyncOpenAI, APIError, APIStatusError, BadRequestError, RateLimitError, APIConnectionError
 from ..config import config_manager
 
 # Chunk 回调类型
@@ -15,6 +23,95 @@ ChunkCallback = Callable[[str, str], Awaitable[None]]  # (chunk_content, chunk_t
 MAX_RETRIES = 3
 RETRY_DELAY = 1.0  # 初始重试延迟（秒）
 RETRY_MULTIPLIER = 2.0  # 重试延迟倍增因子
+MAX_DELAY = 30.0  # 单次重试延迟上限（秒）
+JITTER = 0.5  # 随机抖动比例（延迟乘以 1 ~ 1+JITTER）
+
+# HTTP 连接池配置（客户端复用，保持 keep-alive 连接）
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0)
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=5.0, pool=5.0)
+# 安装了 h2（httpx[http2]）时启用 HTTP/2，并发请求复用同一连接；否则退回 HTTP/1.1
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# 响应缓存配置（chat(cache=True) 时启用）
+RESPONSE_CACHE_MAX_SIZE = 256
+RESPONSE_CACHE_TTL = 300.0  # 秒
+
+
+def _reasoning_from_extra(delta) -> Optional[str]:
+    """qwen3 兼容模式：reasoning_content 是 SDK 未声明的字段，位于 model_extra 中"""
+    extra = delta.model_extra
+    return extra.get("reasoning_content") if extra else None
+
+
+def _reasoning_from_attr(delta) -> Optional[str]:
+    """SDK 已声明 reasoning_content 字段（或非 pydantic 对象）时直接读属性"""
+    return getattr(delta, "reasoning_content", None)
+
+
+def _reasoning_extractor(delta) -> Callable[[Any], Optional[str]]:
+    """
+    根据 delta 的类型选定思考内容的获取方式
+    流式循环中对每个 chunk 直接调用，不再逐个 hasattr / getattr 探测
+    """
+    fields = getattr(type(delta), "model_fields", None)
+    if fields is not None and "reasoning_content" in fields:
+        return _reasoning_from_attr
+    if hasattr(delta, "model_extra"):
+        return _reasoning_from_extra
+    return _reasoning_from_attr
+
+
+class _ChunkCoalescer:
+    """
+    合并流式小 chunk 后再回调，减少逐 token 的 await 与下游推送次数
+    
+    相邻的同类型 chunk 拼接在一起，整体顺序与接收顺序一致；
+    距上次回调超过 interval 秒或累计超过 max_chars 个字符时回调一次
+    
+    回调异常统一在 emit 中处理：首次失败后打印错误并停止后续回调，不再逐 chunk 抛出 / 捕获
+    """
+    
+    def __init__(self, callback: ChunkCallback, interval: float = 0.03, max_chars: int = 256):
+        self._callback = callback
+        self._interval = interval
+        self._max_chars = max_chars
+        self._parts: List[Tuple[str, List[str]]] = []  # [(chunk_type, [content, ...]), ...]
+        self._size = 0
+        self._loop = asyncio.get_running_loop()
+        self._last_flush = self._loop.time()
+        self._broken = False  # 回调出错后置为 True
+    
+    def add(self, content: str, chunk_type: str):
+        if self._broken:
+            return
+        if self._parts and self._parts[-1][0] == chunk_type:
+            self._parts[-1][1].append(content)
+        else:
+            self._parts.append((chunk_type, [content]))
+        self._size += len(content)
+    
+    async def maybe_flush(self):
+        if self._parts and (
+            self._size >= self._max_chars
+            or self._loop.time() - self._last_flush >= self._interval
+        ):
+            await self.flush()
+    
+    async def flush(self):
+        parts, self._parts, self._size = self._parts, [], 0
+        self._last_flush = self._loop.time()
+        for chunk_type, contents in parts:
+            await self.emit("".join(contents), chunk_type)
+    
+    async def emit(self, content: str, chunk_type: str):
+        """直接回调一次（不经过合并缓冲）"""
+        if self._broken:
+            return
+        try:
+            await self._callback(content, chunk_type)
+        except Exception as e:
+            print(f"[LLM] chunk_callback 错误，后续 chunk 不再回调: {e}")
+            self._broken = True
 
 
 class LLMClient:
@@ -33,21 +130,119 @@ class LLMClient:
             return
         self._initialized = True
         self._client: Optional[AsyncOpenAI] = None
+        self._client_key: Optional[Tuple[str, str]] = None
+        # 创建 / 校验当前客户端时的配置版本号，版本未变时跳过配置读取
+        self._client_generation: Optional[int] = None
+        # 配置变更后被替换的旧客户端（可能仍有进行中的请求），关闭时统一释放
+        self._retired_clients: List[AsyncOpenAI] = []
+        # 每个 Agent 的固定请求参数模板（按配置版本号失效）
+        self._base_params_cache: Dict[str, Mapping[str, Any]] = {}
+        self._base_params_generation: Optional[int] = None
+        # 服务端不接受 stream_options 时置为 False，之后的流式请求不再携带
+        self._stream_usage_supported = True
+        # 响应缓存: key -> (写入时间, 结果)
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
     
     def _get_client(self) -> AsyncOpenAI:
-        """获取或创建 OpenAI 客户端"""
+        """获取 OpenAI 客户端（复用连接池，仅在 API Key / Base URL 变化时重建）"""
+        generation = config_manager.generation
+        if self._client is not None and self._client_generation == generation:
+            return self._client
+        
         client_config = config_manager.get_llm_client_config()
         
         if not client_config["api_key"]:
             raise ValueError("API Key 未配置，请先在配置页面设置 API Key")
         
-        # 每次都重新创建客户端以确保使用最新配置
+        key = (client_config["api_key"], client_config["base_url"])
+        if self._client is not None and self._client_key == key:
+            self._client_generation = generation
+            return self._client
+        
+        if self._client is not None:
+            self._retired_clients.append(self._client)
+            # API Key / Base URL 变化后旧响应不再可信
+            self.clear_cache()
         self._client = AsyncOpenAI(
             api_key=client_config["api_key"],
             base_url=client_config["base_url"],
+            http_client=httpx.AsyncClient(
+                http2=HTTP2_ENABLED, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT
+            ),
         )
+        self._client_key = key
+        self._client_generation = generation
         return self._client
     
+    def _base_params(self, agent_name: str) -> Mapping[str, Any]:
+        """
+        获取 Agent 的固定请求参数（model / max_tokens / temperature / top_p / extra_body）
+        按 Agent 缓存只读模板，配置变更（版本号递增）后重建
+        """
+        generation = config_manager.generation
+        if self._base_params_generation != generation:
+            self._base_params_cache = {}
+            self._base_params_generation = generation
+        
+        base = self._base_params_cache.get(agent_name)
+        if base is None:
+            agent_config = config_manager.get_agent_config(agent_name)
+            params = {
+                "model": agent_config["model"],
+                "max_tokens": agent_config["max_tokens"],
+                "temperature": agent_config["temperature"],
+                "top_p": agent_config["top_p"],
+            }
+            # 处理思考模式（qwen3 特有参数）
+            if agent_config.get("enable_thinking"):
+                params["extra_body"] = {"enable_thinking": True}
+            base = self._base_params_cache[agent_name] = MappingProxyType(params)
+        return base
+    
+    def clear_cache(self):
+        """清空响应缓存"""
+        self._cache.clear()
+    
+    @staticmethod
+    def _cache_key(request_params: Dict[str, Any]) -> str:
+        """缓存 key：模型、消息与生成参数的摘要"""
+        payload = orjson.dumps(
+            {k: v for k, v in request_params.items() if k != "stream"},
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > RESPONSE_CACHE_TTL:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return dict(entry[1])
+    
+    def _cache_put(self, key: str, result: Dict[str, Any]):
+        self._cache[key] = (time.monotonic(), dict(result))
+        self._cache.move_to_end(key)
+        while len(self._cache) > RESPONSE_CACHE_MAX_SIZE:
+            self._cache.popitem(last=False)
+    
+    async def close(self):
+        """关闭所有客户端的连接池（应用退出时调用）"""
+        clients = self._retired_clients
+        if self._client is not None:
+            clients.append(self._client)
+        self._client = None
+        self._client_key = None
+        self._client_generation = None
+        self._retired_clients = []
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"[LLM] 关闭客户端失败: {e}")
+    
     async def chat(
         self,
         messages: List[Dict[str, str]],
@@ -55,6 +250,9 @@ class LLMClient:
         tools: Optional[List[Dict]] = None,
         stream: bool = False,
         chunk_callback: Optional[ChunkCallback] = None,
+        max_tokens: Optional[int] = None,
+        cache: bool = False,
+        stream_hint: bool = True,
     ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
         """
         发送聊天请求
@@ -65,64 +263,103 @@ class LLMClient:
             tools: 工具定义列表
             stream: 是否流式返回
             chunk_callback: 流式接收时的回调函数（即使 stream=False 也可以用于实时显示）
+            max_tokens: 覆盖 Agent 配置中的 max_tokens（输出很短的调用可用于限制生成长度）
+            cache: 是否使用响应缓存（仅 stream=False 且无 tools 时生效）；
+                相同模型、消息与参数在 TTL 内直接返回上次结果，命中时不会调用 chunk_callback
+            stream_hint: 是否需要逐 chunk 回调；为 False 时即使传入 chunk_callback 也走非流式请求，
+                完成后整体回调一次（thinking / content 各一次）。
+                Agent 开启思考模式时接口只接受流式请求，此时仍流式接收
         
         Returns:
             如果 stream=False，返回完整响应
             如果 stream=True，返回异步生成器
         """
         client = self._get_client()
-        agent_config = config_manager.get_agent_config(agent_name)
+        
+        base_params = self._base_params(agent_name)
         
         # 构建请求参数
-        # 如果有 chunk_callback，使用流式接收（但仍返回完整结果）
-        use_streaming = stream or (chunk_callback is not None)
+        # 如果有 chunk_callback 且需要逐 chunk 回调，使用流式接收（但仍返回完整结果）；
+        # 思考模式（qwen3 enable_thinking）只支持流式请求，有回调时同样流式接收
+        use_streaming = stream or (
+            chunk_callback is not None and (stream_hint or "extra_body" in base_params)
+        )
         
         request_params = {
-            "model": agent_config["model"],
+            **base_params,
             "messages": messages,
-            "max_tokens": agent_config["max_tokens"],
-            "temperature": agent_config["temperature"],
-            "top_p": agent_config["top_p"],
             "stream": use_streaming,
         }
+        if max_tokens:
+            request_params["max_tokens"] = max_tokens
         
         # 添加工具
         if tools:
             request_params["tools"] = tools
         
-        # 处理思考模式（qwen3 特有参数）
-        if agent_config.get("enable_thinking"):
-            # qwen3-max 支持 enable_thinking 参数
-            request_params["extra_body"] = {
-                "enable_thinking": True
-            }
-        
         if stream:
             return self._stream_chat(client, request_params)
-        elif chunk_callback:
+        
+        cache_key = None
+        if cache and not tools:
+            cache_key = self._cache_key(request_params)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                print(f"[LLM] 命中响应缓存: model={request_params['model']}")
+                return cached
+        
+        if use_streaming:
             # 使用流式接收，但返回完整结果
-            return await self._streaming_complete_chat(client, request_params, chunk_callback)
+            result = await self._streaming_complete_chat(client, request_params, chunk_callback)
         else:
-            return await self._complete_chat(client, request_params)
-    
-    async def _complete_chat(
-        self, 
-        client: AsyncOpenAI, 
-        params: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """非流式聊天（带重试机制）"""
-        print(f"\n[LLM] 发送请求: model={params.get('model')}, messages={len(params.get('messages', []))}")
+            result = await self._complete_chat(client, request_params)
+            if chunk_callback:
+                # 调用方不需要逐 chunk 推送：完成后整体回调一次
+                emitter = _ChunkCoalescer(chunk_callback)
+                for chunk_type in ("thinking", "content"):
+                    if result.get(chunk_type):
+                        await emitter.emit(result[chunk_type], chunk_type)
+        
+        if cache_key is not None and result.get("content"):
+            self._cache_put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """
+        计算重试等待时间：带随机抖动的指数退避（避免并发请求同时重试），
+        限流响应带 Retry-After 时不少于该值
+        """
+        delay = min(MAX_DELAY, RETRY_DELAY * (RETRY_MULTIPLIER ** attempt))
+        delay *= 1 + random.random() * JITTER
         
-        last_error = None
+        if isinstance(error, RateLimitError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                delay = max(delay, min(MAX_DELAY, float(retry_after)))
+            except (TypeError, ValueError):
+                pass
+        return delay
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """连接错误、限流、5xx 可重试；其他 API 错误（如 400 参数错误）重试也无用"""
+        if isinstance(error, (APIConnectionError, RateLimitError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+    
+    async def _create_with_retry(self, client: AsyncOpenAI, params: Dict[str, Any]):
+        """发送 chat.completions 请求（带重试机制）"""
         for attempt in range(MAX_RETRIES):
             try:
-                response = await client.chat.completions.create(**params)
-                break  # 成功，跳出循环
-            except (APIError, RateLimitError, APIConnectionError) as e:
-                last_error = e
-                delay = RETRY_DELAY * (RETRY_MULTIPLIER ** attempt)
+                return await client.chat.completions.create(**params)
+            except APIError as e:
+                if not self._is_retryable(e):
+                    print(f"[LLM] 请求异常（不重试）: {e}")
+                    raise
                 print(f"[LLM] 请求失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
                 if attempt < MAX_RETRIES - 1:
+                    delay = self._retry_delay(e, attempt)
                     print(f"[LLM] 等待 {delay:.1f}s 后重试...")
                     await asyncio.sleep(delay)
                 else:
@@ -132,6 +369,16 @@ class LLMClient:
                 # 非重试异常，直接抛出
                 print(f"[LLM] 请求异常（不重试）: {e}")
                 raise
+    
+    async def _complete_chat(
+        self, 
+        client: AsyncOpenAI, 
+        params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """非流式聊天（带重试机制）"""
+        print(f"\n[LLM] 发送请求: model={params.get('model')}, messages={len(params.get('messages', []))}")
+        
+        response = await self._create_with_retry(client, params)
         
         message = response.choices[0].message
         result = {
@@ -179,63 +426,60 @@ class LLMClient:
     ) -> Dict[str, Any]:
         """
         使用流式接收，但返回完整结果（带重试机制）
-        每收到一个 chunk 就调用 callback
+        收到的 chunk 合并后批量回调 callback（见 _ChunkCoalescer）
         """
         print(f"\n[LLM] 发送请求(流式): model={params.get('model')}, messages={len(params.get('messages', []))}")
         
-        last_error = None
-        for attempt in range(MAX_RETRIES):
+        # 请求在最后一个 chunk 中返回 token 用量，调用方无需为统计用量再发一次非流式请求
+        if self._stream_usage_supported:
             try:
-                response = await client.chat.completions.create(**params)
-                break  # 成功，跳出循环
-            except (APIError, RateLimitError, APIConnectionError) as e:
-                last_error = e
-                delay = RETRY_DELAY * (RETRY_MULTIPLIER ** attempt)
-                print(f"[LLM] 请求失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
-                if attempt < MAX_RETRIES - 1:
-                    print(f"[LLM] 等待 {delay:.1f}s 后重试...")
-                    await asyncio.sleep(delay)
-                else:
-                    print(f"[LLM] 重试次数已用尽，抛出异常")
+                response = await self._create_with_retry(
+                    client, {**params, "stream_options": {"include_usage": True}}
+                )
+            except BadRequestError as e:
+                if "stream_options" not in str(e):
                     raise
-            except Exception as e:
-                print(f"[LLM] 请求异常（不重试）: {e}")
-                raise
+                print("[LLM] 服务端不支持 stream_options，流式请求不再统计用量")
+                self._stream_usage_supported = False
+                response = await self._create_with_retry(client, params)
+        else:
+            response = await self._create_with_retry(client, params)
         
         # 聚合结果
         content_parts = []
         thinking_parts = []
-        tool_calls_data = {}  # id -> {id, type, function: {name, arguments}}
+        coalescer = _ChunkCoalescer(chunk_callback)
+        tool_calls_data = {}  # index -> {id, type, function: {name, arguments}}
+        tool_args_parts: Dict[int, List[str]] = {}  # index -> 参数片段（结束后一次 join）
+        
+        extract_reasoning = None
+        usage = None
         
         async for chunk in response:
+            if chunk.usage is not None:
+                usage = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens,
+                }
             if not chunk.choices:
                 continue
             
             delta = chunk.choices[0].delta
             
-            # 处理思考内容
-            reasoning_content = None
-            if hasattr(delta, 'model_extra') and delta.model_extra:
-                reasoning_content = delta.model_extra.get('reasoning_content')
-            if not reasoning_content and hasattr(delta, 'reasoning_content'):
-                reasoning_content = getattr(delta, 'reasoning_content', None)
+            # 处理思考内容（获取方式在首个 delta 上确定一次）
+            if extract_reasoning is None:
+                extract_reasoning = _reasoning_extractor(delta)
+            reasoning_content = extract_reasoning(delta)
             
             if reasoning_content:
                 thinking_parts.append(reasoning_content)
-                # 调用回调
-                try:
-                    await chunk_callback(reasoning_content, "thinking")
-                except Exception as e:
-                    print(f"[LLM] chunk_callback 错误: {e}")
+                coalescer.add(reasoning_content, "thinking")
             
             # 处理正常内容
             if delta.content:
                 content_parts.append(delta.content)
-                # 调用回调
-                try:
-                    await chunk_callback(delta.content, "content")
-                except Exception as e:
-                    print(f"[LLM] chunk_callback 错误: {e}")
+                coalescer.add(delta.content, "content")
             
             # 处理工具调用（流式工具调用需要聚合）
             # 注意：流式模式下，tc.id 只在第一个 chunk 出现，后续为 None
@@ -253,6 +497,7 @@ class LLMClient:
                                     "arguments": "",
                                 }
                             }
+                            tool_args_parts[tc_index] = []
                         # 更新工具调用数据
                         if tc.id:
                             tool_calls_data[tc_index]["id"] = tc.id
@@ -262,17 +507,18 @@ class LLMClient:
                             if tc.function.name:
                                 tool_calls_data[tc_index]["function"]["name"] = tc.function.name
                                 # 发射工具名称 chunk
-                                try:
-                                    await chunk_callback(f"[Tool: {tc.function.name}] ", "tool_name")
-                                except Exception as e:
-                                    print(f"[LLM] chunk_callback 错误: {e}")
+                                coalescer.add(f"[Tool: {tc.function.name}] ", "tool_name")
                             if tc.function.arguments:
-                                tool_calls_data[tc_index]["function"]["arguments"] += tc.function.arguments
+                                tool_args_parts[tc_index].append(tc.function.arguments)
                                 # 发射工具参数 chunk（流式显示参数生成过程）
-                                try:
-                                    await chunk_callback(tc.function.arguments, "tool_args")
-                                except Exception as e:
-                                    print(f"[LLM] chunk_callback 错误: {e}")
+                                coalescer.add(tc.function.arguments, "tool_args")
+            
+            await coalescer.maybe_flush()
+        
+        await coalescer.flush()
+        
+        for tc_index, parts in tool_args_parts.items():
+            tool_calls_data[tc_index]["function"]["arguments"] = "".join(parts)
         
         # 构建最终结果
         result = {
@@ -280,7 +526,7 @@ class LLMClient:
             "role": "assistant",
             "tool_calls": list(tool_calls_data.values()) if tool_calls_data else None,
             "thinking": "".join(thinking_parts) if thinking_parts else None,
-            "usage": None,  # 流式模式下可能没有 usage
+            "usage": usage,  # 服务端不支持 stream_options 时为 None
         }
         
         # 日志输出
@@ -306,6 +552,7 @@ class LLMClient:
             {"type": "content", "content": "..."} - 正常内容
         """
         response = await client.chat.completions.create(**params)
+        extract_reasoning = None
         
         async for chunk in response:
             if not chunk.choices:
@@ -313,19 +560,13 @@ class LLMClient:
             
             delta = chunk.choices[0].delta
             
-            # 获取思考内容 (qwen3 的 reasoning_content 在 model_extra 中)
-            reasoning_content = None
-            
-            # 从 model_extra 中获取 (qwen3 的主要方式)
-            if hasattr(delta, 'model_extra') and delta.model_extra:
-                reasoning_content = delta.model_extra.get('reasoning_content')
-            
-            # 备用: 直接属性
-            if not reasoning_content and hasattr(delta, 'reasoning_content'):
-                reasoning_content = getattr(delta, 'reasoning_content', None)
+            # 获取思考内容（获取方式在首个 delta 上确定一次）
+            if extract_reasoning is None:
+                extract_reasoning = _reasoning_extractor(delta)
+            reasoning_content = extract_reasoning(delta)
             
             # 只有非空内容才 yield
-            if reasoning_content and len(reasoning_content) > 0:
+            if reasoning_content:
                 yield {"type": "thinking", "content": reasoning_content}
             
             # 正常内容
@@ -354,15 +595,11 @@ class LLMClient:
         import sys
         
         client = self._get_client()
-        agent_config = config_manager.get_agent_config(agent_name)
         
         # 构建请求参数
         request_params = {
-            "model": agent_config["model"],
+            **self._base_params(agent_name),
             "messages": messages,
-            "max_tokens": agent_config["max_tokens"],
-            "temperature": agent_config["temperature"],
-            "top_p": agent_config["top_p"],
             "stream": True,
         }
         
@@ -370,32 +607,40 @@ class LLMClient:
         if tools:
             request_params["tools"] = tools
         
-        # 处理思考模式
-        if agent_config.get("enable_thinking"):
-            request_params["extra_body"] = {
-                "enable_thinking": True
-            }
-        
         # 打印前缀
         if prefix:
             print(f"\n{prefix}", end="", flush=True)
         
         # 流式调用并打印
-        full_content = ""
+        content_parts: List[str] = []
         response = await client.chat.completions.create(**request_params)
-        
+
+        # 控制台输出缓冲：约 30ms 或累计 256 字符写出一次，避免每个 token 一次 flush
+        buf: List[str] = []
+        buf_len = 0
+        last_flush = time.monotonic()
+
         async for chunk in response:
             if chunk.choices and chunk.choices[0].delta.content:
                 content = chunk.choices[0].delta.content
-                full_content += content
-                # 实时打印到控制台
-                print(content, end="", flush=True)
-        
-        # 打印换行
-        print("", flush=True)
-        
+                content_parts.append(content)
+                buf.append(content)
+                buf_len += len(content)
+                now = time.monotonic()
+                if buf_len >= 256 or now - last_flush >= 0.03:
+                    sys.stdout.write("".join(buf))
+                    sys.stdout.flush()
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = now
+
+        # 写出剩余内容并换行
+        buf.append("\n")
+        sys.stdout.write("".join(buf))
+        sys.stdout.flush()
+
         return {
-            "content": full_content,
+            "content": "".join(content_parts),
             "role": "assistant",
             "tool_calls": None,
             "thinking": None,
@@ -404,6 +649,7 @@ class LLMClient:
     
     async def test_connection(self) -> Dict[str, Any]:
         """测试 API 连接"""
+        # 内部工具类调用不传 chunk_callback，直接走非流式请求
         try:
             result = await self.chat(
                 messages=[{"role": "user", "content": "你好，请用一句话介绍自己。"}],
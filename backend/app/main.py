@@ -1,32 +1,47 @@
 """
 Chat2Excel 后端主应用
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 from pathlib import Path
 
 from .api.config_routes import router as config_router
 from .api.chat_routes import router as chat_router
-from .api.upload_routes import router as upload_router
+from .api.upload_routes import router as upload_router, shutdown_process_pool
 from .api.report_routes import router as report_router
 from .config import config_manager
+from .llm import llm_client
+from .models.session import session_manager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：退出时写入未落盘的会话，关闭 CSV 解析进程池，并释放 LLM 客户端连接池"""
+    yield
+    session_manager.flush()
+    shutdown_process_pool()
+    await llm_client.close()
+
 
 # 创建应用
 app = FastAPI(
     title="Chat2Excel API",
     description="数据分析 Agent 系统 API",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
-# CORS 配置
+# CORS 配置：显式列出来源，预检结果由浏览器缓存一天
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # 开发环境允许所有来源
+    allow_origins=config_manager.app_settings.allowed_origins,
+    allow_origin_regex=config_manager.app_settings.allowed_origin_regex,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
 # 注册路由
@@ -36,41 +51,6 @@ app.include_router(upload_router, prefix="/api", tags=["数据上传"])
 app.include_router(report_router, prefix="/api")
 
 
-# 静态文件（前端）- 直接服务开发目录
-frontend_path = Path(__file__).parent.parent.parent / "frontend"
-if frontend_path.exists():
-    # 挂载静态文件
-    app.mount("/static", StaticFiles(directory=frontend_path), name="static")
-    
-    @app.get("/")
-    async def serve_frontend():
-        return FileResponse(frontend_path / "index.html")
-    
-    @app.get("/report.html")
-    async def serve_report():
-        return FileResponse(frontend_path / "report.html")
-    
-    @app.get("/test-charts.html")
-    async def serve_test_charts():
-        return FileResponse(frontend_path / "test-charts.html")
-    
-    @app.get("/test-sort.html")
-    async def serve_test_sort():
-        return FileResponse(frontend_path / "test-sort.html")
-    
-    @app.get("/monitor.html")
-    async def serve_monitor():
-        return FileResponse(frontend_path / "monitor.html")
-    
-    @app.get("/{filename}.css")
-    async def serve_css(filename: str):
-        return FileResponse(frontend_path / f"{filename}.css", media_type="text/css")
-    
-    @app.get("/{filename}.js")
-    async def serve_js(filename: str):
-        return FileResponse(frontend_path / f"{filename}.js", media_type="application/javascript")
-
-
 @app.get("/api/health", tags=["系统"])
 async def health_check():
     """健康检查"""
@@ -92,6 +72,16 @@ async def get_status():
     }
 
 
+# 静态文件（前端）- 直接服务开发目录
+# 必须最后挂载到 "/"，否则会遮蔽上面的 /api 路由
+# StaticFiles 自带 ETag / Last-Modified 协商缓存，html=True 时 "/" 返回 index.html
+frontend_path = Path(__file__).parent.parent.parent / "frontend"
+if frontend_path.exists():
+    # 兼容旧的 /static 前缀
+    app.mount("/static", StaticFiles(directory=frontend_path), name="static")
+    app.mount("/", StaticFiles(directory=frontend_path, html=True), name="frontend")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
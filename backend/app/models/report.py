@@ -1,17 +1,24 @@
 """
 报告数据模型
 """
+import os
 import json
 import uuid
+import asyncio
+import threading
 from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Any, Optional
-from pydantic import BaseModel, Field
+
+import orjson
+from pydantic import BaseModel, Field, ValidationError, field_validator
 
 
 class ChartConfig(BaseModel):
     """图表配置"""
-    chart_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    chart_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     chart_type: str  # bar, line, pie, dual_axis_mixed, etc.
     title: str
     data_sources: List[Dict[str, Any]]
@@ -21,7 +28,7 @@ class ChartConfig(BaseModel):
 
 class ReportSection(BaseModel):
     """报告章节"""
-    section_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    section_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     title: str
     content: str  # Markdown 格式的文本内容
     charts: List[ChartConfig] = []
@@ -29,9 +36,13 @@ class ReportSection(BaseModel):
     order: int = 0
 
 
+# generation_log 保留的最大条数（只保留最近的日志，避免报告文件随生成过程无限增长）
+MAX_GENERATION_LOG = 500
+
+
 class Report(BaseModel):
     """报告"""
-    report_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    report_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     session_id: str
     title: str
     summary: str = ""  # 报告摘要
@@ -41,20 +52,275 @@ class Report(BaseModel):
     status: str = "draft"  # draft, generating, completed, error
     
     # 生成过程中的元数据
-    generation_log: List[str] = []
+    generation_log: List[str] = []  # 最多保留最近 MAX_GENERATION_LOG 条
     source_questions: List[str] = []  # 触发生成的问题
+    
+    @field_validator("generation_log")
+    @classmethod
+    def _truncate_generation_log(cls, value: List[str]) -> List[str]:
+        return value[-MAX_GENERATION_LOG:] if len(value) > MAX_GENERATION_LOG else value
 
 
-class ReportManager:
-    """报告管理器"""
+# ============ 报告存储 ============
+
+# 报告存储目录（模块加载时计算一次）
+# 报告路由（CenterAgent 生成的报告）与 ReportManager 共用这一份文件、索引与内存缓存
+REPORTS_DIR = Path(__file__).resolve().parents[3] / "data" / "reports"
+REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+
+# 简单的内存存储（生产环境应使用数据库）
+# 以下读写函数均为同步阻塞 IO，异步代码中通过 asyncio.to_thread 调用，避免阻塞事件循环
+# LRU 缓存，只保留最近访问的报告，超出上限的从文件重新加载
+_REPORTS_STORE_MAX_SIZE = 128
+_reports_store: "OrderedDict[str, dict]" = OrderedDict()
+_reports_store_lock = threading.Lock()
+
+
+def _store_get(report_id: str) -> Optional[dict]:
+    """从内存缓存读取报告（命中时标记为最近使用）"""
+    with _reports_store_lock:
+        report = _reports_store.get(report_id)
+        if report is not None:
+            _reports_store.move_to_end(report_id)
+        return report
+
+
+def _store_put(report_id: str, report: dict):
+    """写入内存缓存，超出上限时淘汰最久未使用的报告"""
+    with _reports_store_lock:
+        _reports_store[report_id] = report
+        _reports_store.move_to_end(report_id)
+        while len(_reports_store) > _REPORTS_STORE_MAX_SIZE:
+            _reports_store.popitem(last=False)
+
+
+# 报告文件写入选项：紧凑输出（不缩进），支持 numpy 类型，NaN 写为 null
+_REPORT_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+_REPORT_WRITE_BUFFER = 64 * 1024
+
+
+def _write_report_file(report_file: Path, report: dict):
+    """
+    逐字段写入报告 JSON，sections 按章节逐个序列化
+    峰值内存只与单个章节大小相关，而不是整份报告
+    
+    先写入 <id>.json.tmp 再 os.replace，写入中途出错或进程退出不会留下半截报告文件
+    """
+    tmp_file = report_file.with_suffix(".json.tmp")
+    try:
+        _stream_report_json(tmp_file, report)
+        os.replace(tmp_file, report_file)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def _stream_report_json(path: Path, report: dict):
+    """将报告逐字段流式写入 path"""
+    with open(path, "wb", buffering=_REPORT_WRITE_BUFFER) as f:
+        f.write(b"{")
+        for i, (key, value) in enumerate(report.items()):
+            if i:
+                f.write(b",")
+            f.write(orjson.dumps(str(key)))
+            f.write(b":")
+            if key == "sections" and isinstance(value, list):
+                f.write(b"[")
+                for j, section in enumerate(value):
+                    if j:
+                        f.write(b",")
+                    f.write(orjson.dumps(section, option=_REPORT_DUMPS_OPTIONS))
+                f.write(b"]")
+            else:
+                f.write(orjson.dumps(value, option=_REPORT_DUMPS_OPTIONS))
+        f.write(b"}")
+
+
+# ============ 报告索引 ============
+
+# 追加写入的 JSONL 清单，记录每份报告的列表摘要
+# list_reports 直接读取内存中的索引，不再逐个打开并解析报告文件
+# 每行一条记录：{"op": "put", "report": {摘要}} 或 {"op": "delete", "report_id": ...}
+_REPORTS_INDEX_NAME = "reports_index.jsonl"
+_reports_index: Optional[Dict[str, dict]] = None
+_reports_index_lock = threading.Lock()
+# 重建索引时并发读取报告文件的线程数上限（避免同时打开过多文件）
+_INDEX_REBUILD_WORKERS = 32
+
+
+def _report_summary(report: dict) -> dict:
+    """提取报告列表所需的摘要字段"""
+    return {
+        "report_id": report.get("report_id", ""),
+        "session_id": report.get("session_id", ""),
+        "title": report.get("title", "未命名报告"),
+        "summary": (report.get("summary") or "")[:100],
+        "status": report.get("status", "unknown"),
+        "section_count": len(report.get("sections", [])),
+        "created_at": report.get("created_at", ""),
+    }
+
+
+def _load_report_summary(report_file: Path) -> Optional[dict]:
+    """读取单个报告文件并提取摘要（重建索引时使用）"""
+    try:
+        return _report_summary(_read_report_file(report_file))
+    except Exception as e:
+        print(f"读取报告文件失败 {report_file}: {e}")
+        return None
+
+
+def _write_reports_index(index: Dict[str, dict]):
+    """重写整个索引文件（重建 / 压缩时使用，先写临时文件再替换）"""
+    index_file = REPORTS_DIR / _REPORTS_INDEX_NAME
+    tmp_file = index_file.with_suffix(".jsonl.tmp")
+    with open(tmp_file, "wb") as f:
+        for summary in index.values():
+            f.write(orjson.dumps({"op": "put", "report": summary}) + b"\n")
+    os.replace(tmp_file, index_file)
+
+
+def _append_reports_index(entry: dict):
+    """向索引文件追加一条记录"""
+    with open(REPORTS_DIR / _REPORTS_INDEX_NAME, "ab") as f:
+        f.write(orjson.dumps(entry) + b"\n")
+
+
+def _get_reports_index() -> Dict[str, dict]:
+    """
+    获取报告索引（调用方需持有 _reports_index_lock）
+    首次调用时回放索引文件；索引文件不存在时扫描已有报告文件重建
+    """
+    global _reports_index
+    if _reports_index is not None:
+        return _reports_index
+    
+    index: Dict[str, dict] = {}
+    index_file = REPORTS_DIR / _REPORTS_INDEX_NAME
+    
+    if index_file.exists():
+        line_count = 0
+        with open(index_file, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                line_count += 1
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # 写入中断留下的残行
+                    continue
+                if entry.get("op") == "delete":
+                    index.pop(entry.get("report_id"), None)
+                elif entry.get("report"):
+                    index[entry["report"]["report_id"]] = entry["report"]
+        
+        # 删除 / 覆盖记录过多时压缩索引文件
+        if line_count > 2 * len(index) + 64:
+            _write_reports_index(index)
+    
+    elif REPORTS_DIR.exists():
+        # 各报告文件相互独立，并发读取解析（跳过 _ 开头的元数据文件）
+        report_files = [p for p in REPORTS_DIR.glob("*.json") if not p.name.startswith("_")]
+        if report_files:
+            with ThreadPoolExecutor(max_workers=min(_INDEX_REBUILD_WORKERS, len(report_files))) as pool:
+                for report_file, summary in zip(report_files, pool.map(_load_report_summary, report_files)):
+                    if summary is not None:
+                        index[summary["report_id"] or report_file.stem] = summary
+        _write_reports_index(index)
+    
+    _reports_index = index
+    return index
+
+
+def _read_report_file(report_file: Path) -> dict:
+    """
+    读取报告文件（orjson 解析）
+    旧版本用 json.dump 写入的文件可能含 NaN 字面量，orjson 不接受，回退到标准库解析
+    """
+    with open(report_file, "rb") as f:
+        content = f.read()
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return json.loads(content)
+
+
+def save_report(report: dict):
+    """保存报告"""
+    report_id = report.get("report_id")
+    if report_id:
+        _store_put(report_id, report)
+        
+        # 同时保存到文件
+        report_file = REPORTS_DIR / f"{report_id}.json"
+        _write_report_file(report_file, report)
+        
+        # 更新索引
+        summary = _report_summary(report)
+        with _reports_index_lock:
+            _get_reports_index()[report_id] = summary
+            _append_reports_index({"op": "put", "report": summary})
+
+
+def get_report(report_id: str) -> Optional[dict]:
+    """获取报告"""
+    report = _store_get(report_id)
+    if report is not None:
+        return report
+    
+    # 尝试从文件加载
+    report_file = REPORTS_DIR / f"{report_id}.json"
+    
+    if report_file.exists():
+        report = _read_report_file(report_file)
+        _store_put(report_id, report)
+        return report
+    
+    return None
+
+
+def list_reports(session_id: str) -> List[dict]:
+    """列出会话的所有报告（从索引读取）"""
+    # 简单过滤（实际应该按 session_id 过滤，索引中已记录 session_id）
+    with _reports_index_lock:
+        reports = list(_get_reports_index().values())
     
-    def __init__(self, data_dir: str = "data"):
-        self.data_dir = Path(data_dir)
-        self.reports_dir = self.data_dir / "reports"
-        self.reports_dir.mkdir(parents=True, exist_ok=True)
+    # 按创建时间排序
+    reports.sort(key=lambda x: x.get("created_at", ""), reverse=True)
     
-    def _get_report_path(self, report_id: str) -> Path:
-        return self.reports_dir / f"{report_id}.json"
+    return reports
+
+
+def delete_report(report_id: str) -> bool:
+    """删除报告"""
+    with _reports_store_lock:
+        _reports_store.pop(report_id, None)
+    
+    report_file = REPORTS_DIR / f"{report_id}.json"
+    
+    if report_file.exists():
+        try:
+            report_file.unlink()
+        except Exception as e:
+            print(f"删除报告文件失败: {e}")
+            return False
+        
+        with _reports_index_lock:
+            if _get_reports_index().pop(report_id, None) is not None:
+                _append_reports_index({"op": "delete", "report_id": report_id})
+        return True
+    
+    return False
+
+
+
+class ReportManager:
+    """
+    报告管理器（pydantic 模型接口）
+    不单独维护文件与索引，读写都经过上面的报告存储，与报告路由共用同一份数据
+    """
     
     def create_report(self, session_id: str, title: str, summary: str = "") -> Report:
         """创建新报告"""
@@ -67,45 +333,47 @@ class ReportManager:
         return report
     
     def save_report(self, report: Report):
-        """保存报告"""
+        """保存报告（同步阻塞 IO）"""
         report.updated_at = datetime.now().isoformat()
-        with open(self._get_report_path(report.report_id), "w", encoding="utf-8") as f:
-            json.dump(report.model_dump(), f, ensure_ascii=False, indent=2)
+        save_report(report.model_dump(mode="json"))
+    
+    async def save_report_async(self, report: Report):
+        """保存报告（在线程中执行文件写入，不阻塞事件循环）"""
+        await asyncio.to_thread(self.save_report, report)
     
     def get_report(self, report_id: str) -> Optional[Report]:
-        """获取报告"""
-        path = self._get_report_path(report_id)
-        if not path.exists():
+        """
+        获取报告
+        返回独立的模型副本，修改后需调用 save_report 才会写回存储；
+        结构与 Report 不一致的报告（如 CenterAgent 生成的报告）返回 None
+        """
+        data = get_report(report_id)
+        if data is None:
             return None
-        
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return Report(**data)
-    
-    def list_reports(self, session_id: str = None) -> List[Report]:
-        """列出报告"""
-        reports = []
-        for path in self.reports_dir.glob("*.json"):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                report = Report(**data)
-                if session_id is None or report.session_id == session_id:
-                    reports.append(report)
-            except Exception as e:
-                print(f"加载报告失败 {path}: {e}")
+        try:
+            return Report.model_validate(data)
+        except ValidationError as e:
+            print(f"报告结构不匹配 {report_id}: {e}")
+            return None
+    
+    def list_reports(self, session_id: str = None) -> List[Dict[str, Any]]:
+        """
+        列出报告元数据（从索引读取）
+        完整报告内容通过 get_report 加载
+        """
+        with _reports_index_lock:
+            reports = [
+                dict(entry) for entry in _get_reports_index().values()
+                if session_id is None or entry.get("session_id") == session_id
+            ]
         
         # 按创建时间倒序
-        reports.sort(key=lambda r: r.created_at, reverse=True)
+        reports.sort(key=lambda r: r.get("created_at", ""), reverse=True)
         return reports
     
     def delete_report(self, report_id: str) -> bool:
         """删除报告"""
-        path = self._get_report_path(report_id)
-        if path.exists():
-            path.unlink()
-            return True
-        return False
+        return delete_report(report_id)
     
     def add_section(self, report_id: str, section: ReportSection) -> Optional[Report]:
         """添加章节"""
@@ -124,11 +392,12 @@ class ReportManager:
         if not report:
             return None
         
-        for section in report.sections:
+        # 只保留模型字段，并经 pydantic 校验（类型不符时抛出 ValidationError，而不是写入错误类型）
+        updates = {k: v for k, v in updates.items() if k in ReportSection.model_fields}
+        
+        for i, section in enumerate(report.sections):
             if section.section_id == section_id:
-                for key, value in updates.items():
-                    if hasattr(section, key):
-                        setattr(section, key, value)
+                report.sections[i] = ReportSection.model_validate({**section.model_dump(), **updates})
                 break
         
         self.save_report(report)
@@ -137,4 +406,3 @@ class ReportManager:
 
 # 全局实例
 report_manager = ReportManager()
-
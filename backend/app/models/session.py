@@ -1,12 +1,60 @@
 """
 会话和数据存储模型
 """
+import os
 import json
+import shutil
 import uuid
+import asyncio
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set, Deque
 from datetime import datetime
-from pydantic import BaseModel, Field
+
+import orjson
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, field_serializer
+
+from ..config import config_manager
+
+
+def _read_session_file(session_file: Path) -> Dict[str, Any]:
+    """
+    读取会话文件（orjson 解析）
+    旧版本用 json.dump 写入的文件可能含 NaN 字面量，orjson 不接受，回退到标准库解析
+    """
+    content = session_file.read_bytes()
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return json.loads(content)
+
+
+def _tail_lines(path: Path, count: int, block_size: int = 8192) -> List[bytes]:
+    """从文件末尾反向按块读取，返回最后 count 行（不读取整个文件）"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= count:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return data.splitlines()[-count:]
+
+
+# 每个文件保留的处理日志条数
+MAX_PROGRESS_LOGS = 50
+
+# 会话版本号生成器（全局单调递增，会话淘汰后重新加载也不会与之前的版本号重复）
+_session_versions = itertools.count(1)
+
+
+def _new_log_buffer() -> Deque[str]:
+    return deque(maxlen=MAX_PROGRESS_LOGS)
 
 
 class ProcessingProgress(BaseModel):
@@ -17,7 +65,17 @@ class ProcessingProgress(BaseModel):
     percent: int = 0  # 完成百分比 (0-100)
     started_at: Optional[str] = None  # 开始时间
     estimated_remaining_seconds: Optional[int] = None  # 预计剩余秒数
-    logs: List[str] = Field(default_factory=list)  # 处理日志
+    # 处理日志（定长环形缓冲，超出 MAX_PROGRESS_LOGS 条时自动丢弃最早的日志；序列化为列表）
+    logs: Deque[str] = Field(default_factory=_new_log_buffer)
+    
+    @field_validator("logs")
+    @classmethod
+    def _to_log_buffer(cls, value) -> Deque[str]:
+        return deque(value, maxlen=MAX_PROGRESS_LOGS)
+    
+    @field_serializer("logs")
+    def _serialize_logs(self, value) -> List[str]:
+        return list(value)
 
 
 class FileInfo(BaseModel):
@@ -26,11 +84,12 @@ class FileInfo(BaseModel):
     row_count: Optional[int] = None  # 行数
     column_count: Optional[int] = None  # 列数
     encoding: Optional[str] = None  # 文件编码
+    delimiter: Optional[str] = None  # 字段分隔符
 
 
 class UploadedFile(BaseModel):
     """上传的文件信息"""
-    file_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    file_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     original_name: str
     stored_path: str
     file_size: int
@@ -44,7 +103,7 @@ class UploadedFile(BaseModel):
 
 class TableKnowledge(BaseModel):
     """表的知识库信息"""
-    table_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    table_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     file_id: str
     table_name: str
     file_name: str
@@ -54,22 +113,156 @@ class TableKnowledge(BaseModel):
     statistics: Dict[str, Any]
     sample_data: List[Dict[str, Any]]
     table_description: Optional[Dict[str, Any]] = None
+    # 解析时识别出的编码和分隔符（查询时按同样的格式读取原始文件）
+    encoding: Optional[str] = None
+    delimiter: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    
+    # model_dump() 结果缓存（表知识库生成后不再修改）
+    _dump_cache: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+    # 紧凑 JSON 序列化结果缓存（会话落盘时直接拼接，不必每次重新序列化 sample_data / statistics）
+    _json_cache: Optional[bytes] = PrivateAttr(default=None)
+    # ContextBuilder 渲染的表上下文缓存 {(类型, 参数...): 文本}
+    _context_cache: Dict[tuple, str] = PrivateAttr(default_factory=dict)
+    
+    def cached_dump(self) -> Dict[str, Any]:
+        """返回缓存的 model_dump() 结果（只读，调用方不要修改）"""
+        if self._dump_cache is None:
+            self._dump_cache = self.model_dump()
+        return self._dump_cache
+    
+    def cached_json(self) -> bytes:
+        """返回缓存的紧凑 JSON 字节"""
+        if self._json_cache is None:
+            self._json_cache = orjson.dumps(self.cached_dump(), option=orjson.OPT_NON_STR_KEYS)
+        return self._json_cache
+    
+    def invalidate_cache(self):
+        """表知识库内容被修改后调用，清除序列化缓存"""
+        self._dump_cache = None
+        self._json_cache = None
+        self._context_cache.clear()
+    
+    @property
+    def context_cache(self) -> Dict[tuple, str]:
+        """ContextBuilder 渲染结果缓存"""
+        return self._context_cache
 
 
 class Session(BaseModel):
     """用户会话"""
-    session_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     files: List[UploadedFile] = Field(default_factory=list)
     tables: List[TableKnowledge] = Field(default_factory=list)
     conversations: List[Dict[str, Any]] = Field(default_factory=list)
+    
+    # 按 ID 建立的索引（不参与序列化），由 SessionManager 在增删文件 / 表时维护
+    _files_by_id: Dict[str, UploadedFile] = PrivateAttr(default_factory=dict)
+    _tables_by_id: Dict[str, TableKnowledge] = PrivateAttr(default_factory=dict)
+    _tables_by_file_id: Dict[str, List[TableKnowledge]] = PrivateAttr(default_factory=dict)
+    # 表列表版本号（表增删时递增）及按版本缓存的 LLM 上下文（由 ContextBuilder 使用）
+    _tables_version: int = PrivateAttr(default=0)
+    _context_cache: Dict[tuple, str] = PrivateAttr(default_factory=dict)
+    # 会话版本号（会话内容每次变化时更新），供接口层按版本缓存派生结果
+    _version: int = PrivateAttr(default=0)
+    
+    def model_post_init(self, __context: Any) -> None:
+        self.reindex()
+    
+    def reindex(self):
+        """根据 files / tables 列表重建 ID 索引"""
+        self._files_by_id = {f.file_id: f for f in self.files}
+        self._tables_by_id = {t.table_id: t for t in self.tables}
+        self._tables_by_file_id = {}
+        for t in self.tables:
+            self._tables_by_file_id.setdefault(t.file_id, []).append(t)
+        self.tables_changed()
+    
+    def tables_changed(self):
+        """表列表变化后调用：递增版本号并清空上下文缓存"""
+        self._tables_version += 1
+        self._context_cache.clear()
+    
+    def touch(self):
+        """会话内容变化后调用：更新版本号"""
+        self._version = next(_session_versions)
+    
+    @property
+    def version(self) -> int:
+        """会话版本号"""
+        return self._version
+    
+    @property
+    def tables_version(self) -> int:
+        """表列表版本号"""
+        return self._tables_version
+    
+    @property
+    def context_cache(self) -> Dict[tuple, str]:
+        """按 (类型, 表版本号, 参数...) 缓存的上下文字符串"""
+        return self._context_cache
+    
+    @property
+    def files_by_id(self) -> Dict[str, UploadedFile]:
+        """file_id -> 文件"""
+        return self._files_by_id
+    
+    @property
+    def tables_by_id(self) -> Dict[str, TableKnowledge]:
+        """table_id -> 表知识库"""
+        return self._tables_by_id
+    
+    @property
+    def tables_by_file_id(self) -> Dict[str, List[TableKnowledge]]:
+        """file_id -> 由该文件生成的表"""
+        return self._tables_by_file_id
+
+
+def _construct_file(data: Dict[str, Any]) -> UploadedFile:
+    """由已落盘的数据直接构建 UploadedFile（跳过校验）"""
+    data = dict(data)
+    if data.get("file_info") is not None:
+        data["file_info"] = FileInfo.model_construct(**data["file_info"])
+    if data.get("progress") is not None:
+        progress = dict(data["progress"])
+        # 旧版本会话文件中日志是列表
+        if "logs" in progress:
+            progress["logs"] = deque(progress["logs"], maxlen=MAX_PROGRESS_LOGS)
+        data["progress"] = ProcessingProgress.model_construct(**progress)
+    return UploadedFile.model_construct(**data)
+
+
+def _construct_session(data: Dict[str, Any]) -> Session:
+    """
+    由会话文件数据直接构建 Session（model_construct 跳过 pydantic 校验）
+    会话文件由 SessionManager 自己写入，内容可信；model_construct 不会递归构建嵌套模型，
+    因此文件 / 表逐个构建
+    """
+    data = dict(data)
+    data["files"] = [_construct_file(f) for f in data.get("files", [])]
+    data["tables"] = [TableKnowledge.model_construct(**t) for t in data.get("tables", [])]
+    return Session.model_construct(**data)
 
 
 class SessionManager:
     """会话管理器 - 负责会话的创建、存储和检索"""
     
+    # 会话落盘的合并间隔（秒）：期间的多次修改只写一次文件
+    SAVE_DEBOUNCE_SECONDS = 0.2
+    # 每个文件保留的处理日志条数
+    MAX_FILE_LOGS = MAX_PROGRESS_LOGS
+    # 日志文件超过该大小时，写入后裁剪为各文件最近 MAX_FILE_LOGS 条
+    MAX_LOGS_FILE_BYTES = 256 * 1024
+    # 内存中缓存的会话数量上限（LRU），超出后淘汰最久未使用的空闲会话
+    MAX_CACHED_SESSIONS = 256
+    # 重建会话索引时并发读取会话文件的线程数上限
+    INDEX_REBUILD_WORKERS = 32
+    # 会话文件中不写入处理日志（日志单独追加到 {session_id}.logs.jsonl）
+    # 表知识库单独序列化（使用 TableKnowledge 的缓存）后拼接
+    _SESSION_DUMP_EXCLUDE = {"files": {"__all__": {"progress": {"logs"}}}, "tables": True}
+    
     def __init__(self, data_dir: str = None):
         if data_dir is None:
             # 使用项目根目录下的 data 目录
@@ -78,37 +271,129 @@ class SessionManager:
             self.data_dir = Path(data_dir)
         self.sessions_dir = self.data_dir / "sessions"
         self.uploads_dir = self.data_dir / "uploads"
+        # 待删除的文件 / 目录先原子改名到这里，再由后台线程删除
+        self.trash_dir = self.data_dir / ".trash"
         self._ensure_dirs()
-        self._sessions: Dict[str, Session] = {}
+        # 会话文件默认紧凑输出；DEEPRESEARCH_SESSION_PRETTY=1 时缩进便于查看
+        self._dump_options = orjson.OPT_NON_STR_KEYS
+        if config_manager.app_settings.session_pretty:
+            self._dump_options |= orjson.OPT_INDENT_2
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # 已缓存会话的文件路径（随会话一起淘汰）
+        self._session_paths: Dict[str, Path] = {}
+        # 已创建过的上传目录（避免每次上传都 mkdir）
+        self._upload_dirs: Set[str] = set()
+        # 会话摘要索引 {session_id: {created_at, updated_at, file_count, table_count}}
+        # list_sessions 只读索引，不再逐个解析会话文件；首次使用时加载，写入会话时更新内存中的摘要，
+        # 索引文件只在合并写入与应用退出时整体写入一次（没有事件循环时立即写入）
+        self._index_path = self.sessions_dir / "_index.json"
+        self._summaries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._summaries_lock = threading.Lock()
+        self._index_dirty = False
+        # 文件状态订阅者: session_id -> 队列列表（队列中放入发生变化的 file_id）
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        # 待落盘的会话（合并写入）
+        self._dirty: Set[str] = set()
+        # 待追加的处理日志 {session_id: [日志行, ...]}，随合并写入一起在线程中追加
+        self._pending_logs: Dict[str, List[bytes]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # 合并写入进行中被删除的会话（_write_batch 跳过它们；淘汰出缓存的会话仍需写入）
+        self._deleted: Set[str] = set()
+        # 后台清空回收目录的任务
+        self._trash_future: Optional[asyncio.Future] = None
+    
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        """订阅会话中文件状态 / 进度的变化（会话被删除时队列中放入 None）"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(session_id, []).append(queue)
+        return queue
+    
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        """取消订阅"""
+        queues = self._subscribers.get(session_id)
+        if queues and queue in queues:
+            queues.remove(queue)
+            if not queues:
+                del self._subscribers[session_id]
+    
+    def _notify_file(self, session: Session, file_id: str):
+        """通知订阅者文件发生了变化（无订阅者时无开销）"""
+        for queue in self._subscribers.get(session.session_id, ()):
+            queue.put_nowait(file_id)
     
     def _ensure_dirs(self):
         """确保目录存在"""
         self.sessions_dir.mkdir(parents=True, exist_ok=True)
         self.uploads_dir.mkdir(parents=True, exist_ok=True)
     
+    def _discard(self, path: Path):
+        """
+        删除文件或目录（不阻塞事件循环）
+        先改名到回收目录（同一文件系统内的 rename，开销很小），实际删除交给后台线程
+        """
+        try:
+            self.trash_dir.mkdir(exist_ok=True)
+            os.replace(path, self.trash_dir / uuid.uuid4().hex)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"删除失败 {path}: {e}")
+            return
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（脚本 / 测试），直接同步删除
+            self._empty_trash()
+            return
+        if self._trash_future is None or self._trash_future.done():
+            self._trash_future = loop.run_in_executor(None, self._empty_trash)
+    
+    def _empty_trash(self):
+        """删除回收目录中的全部内容（在线程中执行）"""
+        # 一次清空过程中可能有新的条目移入，循环到目录为空
+        while True:
+            try:
+                entries = list(os.scandir(self.trash_dir))
+            except FileNotFoundError:
+                return
+            if not entries:
+                return
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                except OSError as e:
+                    print(f"清理回收目录失败 {entry.path}: {e}")
+                    return
+    
     def create_session(self) -> Session:
         """创建新会话"""
         session = Session()
-        self._sessions[session.session_id] = session
-        self._save_session(session)
+        self._cache_session(session)
+        # 新会话立即落盘
+        self._write_session(session)
         return session
     
     def get_session(self, session_id: str) -> Optional[Session]:
         """获取会话"""
         # 先从内存获取
-        if session_id in self._sessions:
-            return self._sessions[session_id]
-        
-        # 从文件加载
-        session_file = self.sessions_dir / f"{session_id}.json"
-        if session_file.exists():
-            with open(session_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            session = Session(**data)
-            self._sessions[session_id] = session
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
             return session
         
-        return None
+        # 从文件加载（直接读取，不存在时捕获异常，省去一次 exists 的 stat 调用）
+        try:
+            data = _read_session_file(self._session_path(session_id))
+        except FileNotFoundError:
+            return None
+        session = _construct_session(data)
+        self._load_file_logs(session)
+        self._cache_session(session)
+        return session
     
     def get_or_create_session(self, session_id: Optional[str] = None) -> Session:
         """获取或创建会话"""
@@ -121,19 +406,323 @@ class SessionManager:
     def update_session(self, session: Session):
         """更新会话"""
         session.updated_at = datetime.now().isoformat()
-        self._sessions[session.session_id] = session
+        session.touch()
+        self._cache_session(session)
         self._save_session(session)
     
+    def _session_path(self, session_id: str) -> Path:
+        """会话文件路径（已缓存的会话复用之前拼接好的路径）"""
+        path = self._session_paths.get(session_id)
+        if path is None:
+            path = self.sessions_dir / f"{session_id}.json"
+        return path
+    
+    def _cache_session(self, session: Session):
+        """放入内存缓存（标记为最近使用），超出上限时淘汰最久未使用的会话"""
+        session_id = session.session_id
+        if session_id not in self._session_paths:
+            self._session_paths[session_id] = self.sessions_dir / f"{session_id}.json"
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        if len(self._sessions) > self.MAX_CACHED_SESSIONS:
+            self._evict_sessions()
+    
+    def _evict_sessions(self):
+        """
+        从最久未使用的会话开始淘汰，直到回到上限
+        仍有文件在处理或有订阅者的会话不淘汰（后台任务持有同一对象，淘汰后重新加载会出现两份副本）；
+        待写入的会话先落盘再淘汰
+        """
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.MAX_CACHED_SESSIONS:
+                break
+            session = self._sessions[session_id]
+            if session_id in self._subscribers or any(
+                f.status in ("pending", "processing") for f in session.files
+            ):
+                continue
+            if session_id in self._dirty:
+                self._dirty.discard(session_id)
+                try:
+                    self._write_session(session)
+                except Exception as e:
+                    print(f"保存会话失败 {session_id}: {e}")
+                    continue
+            lines = self._pending_logs.pop(session_id, None)
+            if lines:
+                self._append_logs(session_id, lines, self._logs_keep(session))
+            del self._sessions[session_id]
+            self._session_paths.pop(session_id, None)
+    
     def _save_session(self, session: Session):
-        """保存会话到文件"""
-        session_file = self.sessions_dir / f"{session.session_id}.json"
-        with open(session_file, "w", encoding="utf-8") as f:
-            json.dump(session.model_dump(), f, ensure_ascii=False, indent=2)
+        """
+        标记会话待保存
+        在事件循环中调用时延迟 SAVE_DEBOUNCE_SECONDS 合并写入（处理文件时进度 / 日志更新非常频繁）；
+        没有运行中的事件循环时（如脚本 / 线程中调用）立即写入
+        """
+        if not self._schedule_flush():
+            self._write_session(session)
+            return
+        self._dirty.add(session.session_id)
+    
+    def _schedule_flush(self) -> bool:
+        """启动延迟合并写入任务（已在等待时不重复启动）；没有运行中的事件循环时返回 False"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+        return True
+    
+    async def _flush_later(self):
+        """
+        等待合并间隔后写入所有待保存的会话与处理日志
+        序列化在事件循环中完成（得到一致的快照），文件写入放到线程中执行，不阻塞事件循环
+        """
+        await asyncio.sleep(self.SAVE_DEBOUNCE_SECONDS)
+        dirty, self._dirty = self._dirty, set()
+        pending_logs, self._pending_logs = self._pending_logs, {}
+        logs = [
+            (session_id, lines, self._logs_keep(self._sessions.get(session_id)))
+            for session_id, lines in pending_logs.items()
+        ]
+        writes = []
+        for session_id in dirty:
+            session = self._sessions.get(session_id)
+            if session is None:
+                continue
+            try:
+                writes.append((
+                    session_id,
+                    self._session_path(session_id),
+                    self._dump_session(session),
+                    self._session_summary(session),
+                ))
+            except Exception as e:
+                print(f"保存会话失败 {session_id}: {e}")
+        try:
+            if writes or logs or self._index_dirty:
+                await asyncio.to_thread(self._write_batch, writes, logs)
+        finally:
+            self._deleted.clear()
+        # 写入期间又有新的修改：本任务仍未结束，_schedule_flush 不会重新启动，这里接着处理
+        if self._dirty or self._pending_logs:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+    
+    def _write_batch(self, writes: List[tuple], logs: List[tuple] = ()):
+        """
+        在线程中批量写入会话文件与处理日志（写入前已被删除的会话跳过），
+        最后统一更新一次索引
+        """
+        for session_id, lines, keep in logs:
+            if session_id not in self._deleted:
+                self._append_logs(session_id, lines, keep)
+        summaries = []
+        for session_id, session_file, data, summary in writes:
+            if session_id in self._deleted:
+                continue
+            try:
+                self._write_session_bytes(session_file, data)
+                summaries.append(summary)
+            except Exception as e:
+                print(f"保存会话失败 {session_id}: {e}")
+        if summaries:
+            self._update_summaries(summaries)
+        self._write_index_if_dirty()
+    
+    def flush(self):
+        """立即写入所有待保存的会话、处理日志与会话索引（应用退出时调用）"""
+        pending_logs, self._pending_logs = self._pending_logs, {}
+        for session_id, lines in pending_logs.items():
+            self._append_logs(session_id, lines, self._logs_keep(self._sessions.get(session_id)))
+        dirty, self._dirty = self._dirty, set()
+        for session_id in dirty:
+            session = self._sessions.get(session_id)
+            if session is None:
+                continue
+            try:
+                self._write_session_file(session)
+            except Exception as e:
+                print(f"保存会话失败 {session_id}: {e}")
+        self._write_index_if_dirty()
+    
+    def _get_logs_path(self, session_id: str) -> Path:
+        """处理日志文件：每行一条 {"file_id": ..., "log": ...}"""
+        return self.sessions_dir / f"{session_id}.logs.jsonl"
+    
+    def _logs_keep(self, session: Optional[Session]) -> int:
+        """裁剪日志文件时保留的行数：每个文件最近 MAX_FILE_LOGS 条（与加载时读取的行数一致）"""
+        file_count = len(session.files) if session is not None else 0
+        return self.MAX_FILE_LOGS * max(1, file_count)
+    
+    def _append_logs(self, session_id: str, lines: List[bytes], keep: int):
+        """
+        向日志文件追加多行（同步阻塞 IO，合并写入时在线程中执行）
+        文件超过 MAX_LOGS_FILE_BYTES 时只保留最后 keep 行，日志文件不会无限增长
+        """
+        logs_path = self._get_logs_path(session_id)
+        try:
+            with open(logs_path, "ab") as log_file:
+                log_file.write(b"".join(lines))
+                size = log_file.tell()
+            if size > self.MAX_LOGS_FILE_BYTES:
+                tail = _tail_lines(logs_path, keep)
+                self._write_session_bytes(logs_path, b"".join(line + b"\n" for line in tail))
+        except Exception as e:
+            print(f"写入处理日志失败 {session_id}: {e}")
+    
+    def _load_file_logs(self, session: Session):
+        """从日志文件末尾读取最近的日志，恢复各文件的 progress.logs"""
+        logs_path = self._get_logs_path(session.session_id)
+        if not session.files or not logs_path.exists():
+            return
+        
+        logs_by_file: Dict[str, List[str]] = {}
+        for line in _tail_lines(logs_path, self.MAX_FILE_LOGS * len(session.files)):
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # 写入中断留下的残行
+                continue
+            logs_by_file.setdefault(entry["file_id"], []).append(entry["log"])
+        
+        for file_id, logs in logs_by_file.items():
+            f = session.files_by_id.get(file_id)
+            if f is not None:
+                if f.progress is None:
+                    f.progress = ProcessingProgress()
+                f.progress.logs = deque(logs, maxlen=MAX_PROGRESS_LOGS)
+    
+    def _dump_session(self, session: Session) -> bytes:
+        """
+        序列化会话（不含处理日志）
+        表知识库生成后不再变化，紧凑输出时直接拼接各表缓存的 JSON 字节，
+        每次写入只重新序列化会话的其余部分（文件状态、进度等）
+        """
+        data = session.model_dump(exclude=self._SESSION_DUMP_EXCLUDE)
+        if self._dump_options & orjson.OPT_INDENT_2:
+            data["tables"] = [t.cached_dump() for t in session.tables]
+            return orjson.dumps(data, option=self._dump_options)
+        
+        head = orjson.dumps(data, option=self._dump_options)
+        tables = b",".join(t.cached_json() for t in session.tables)
+        # head 以 "}" 结尾，会话至少含 session_id 等字段，直接在其前面追加 tables
+        return b"".join((head[:-1], b',"tables":[', tables, b"]}"))
+    
+    @staticmethod
+    def _write_session_bytes(session_file: Path, data: bytes):
+        """
+        写入会话文件（先写临时文件再替换，避免留下写了一半的文件）
+        临时文件名带线程 ID，后台批量写入与同步写入同一会话时互不干扰
+        """
+        tmp_file = session_file.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_file.write_bytes(data)
+        os.replace(tmp_file, session_file)
+    
+    def _write_session_file(self, session: Session):
+        """写入会话文件并更新内存索引"""
+        self._write_session_bytes(self._session_path(session.session_id), self._dump_session(session))
+        self._update_summaries([self._session_summary(session)])
+    
+    def _write_session(self, session: Session):
+        """立即写入会话文件（索引文件交给合并写入，没有事件循环时立即写入）"""
+        self._write_session_file(session)
+        if not self._schedule_flush():
+            self._write_index_if_dirty()
+    
+    # ============ 会话索引 ============
+    
+    @staticmethod
+    def _session_summary(data) -> Dict[str, Any]:
+        """提取会话列表所需的摘要字段（data 为 Session 或会话文件解析出的 dict）"""
+        if isinstance(data, Session):
+            data = {
+                "session_id": data.session_id,
+                "created_at": data.created_at,
+                "updated_at": data.updated_at,
+                "files": data.files,
+                "tables": data.tables,
+            }
+        return {
+            "session_id": data["session_id"],
+            "created_at": data["created_at"],
+            "updated_at": data["updated_at"],
+            "file_count": len(data.get("files", [])),
+            "table_count": len(data.get("tables", [])),
+        }
+    
+    def _load_summary(self, session_file: Path) -> Optional[Dict[str, Any]]:
+        """读取单个会话文件并提取摘要（重建索引时使用）"""
+        try:
+            return self._session_summary(_read_session_file(session_file))
+        except Exception as e:
+            print(f"读取会话文件失败 {session_file}: {e}")
+            return None
+    
+    def _get_summaries(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取会话索引（调用方需持有 _summaries_lock）
+        首次调用时读取索引文件；索引文件不存在或损坏时并发扫描会话文件重建
+        """
+        if self._summaries is not None:
+            return self._summaries
+        
+        summaries = None
+        try:
+            summaries = orjson.loads(self._index_path.read_bytes())
+        except FileNotFoundError:
+            pass
+        except orjson.JSONDecodeError as e:
+            print(f"会话索引损坏，重新构建: {e}")
+        
+        if summaries is None:
+            summaries = {}
+            session_files = [p for p in self.sessions_dir.glob("*.json") if not p.name.startswith("_")]
+            if session_files:
+                with ThreadPoolExecutor(max_workers=min(self.INDEX_REBUILD_WORKERS, len(session_files))) as pool:
+                    for summary in pool.map(self._load_summary, session_files):
+                        if summary is not None:
+                            summaries[summary["session_id"]] = summary
+            self._write_index(summaries)
+        
+        self._summaries = summaries
+        return summaries
+    
+    def _write_index(self, summaries: Dict[str, Dict[str, Any]]):
+        """原子写入索引文件"""
+        self._write_session_bytes(self._index_path, orjson.dumps(summaries))
+    
+    def _write_index_if_dirty(self):
+        """索引有未写入的修改时写入索引文件"""
+        with self._summaries_lock:
+            if self._index_dirty:
+                self._index_dirty = False
+                self._write_index(self._summaries)
+    
+    def _update_summaries(self, summaries: List[Dict[str, Any]]):
+        """更新内存索引中的会话摘要（索引文件由调用方稍后写入）"""
+        with self._summaries_lock:
+            index = self._get_summaries()
+            for summary in summaries:
+                index[summary["session_id"]] = summary
+            self._index_dirty = True
+    
+    def _remove_summary(self, session_id: str):
+        """从索引中移除会话"""
+        with self._summaries_lock:
+            removed = self._get_summaries().pop(session_id, None) is not None
+            if removed:
+                self._index_dirty = True
+        if removed and not self._schedule_flush():
+            self._write_index_if_dirty()
     
     def add_file(self, session: Session, file_info: UploadedFile) -> Session:
         """添加文件到会话"""
         session.files.append(file_info)
+        session.files_by_id[file_info.file_id] = file_info
         self.update_session(session)
+        self._notify_file(session, file_info.file_id)
         return session
     
     def update_file_status(
@@ -144,13 +733,13 @@ class SessionManager:
         error: Optional[str] = None
     ) -> Session:
         """更新文件状态"""
-        for f in session.files:
-            if f.file_id == file_id:
-                f.status = status
-                if error:
-                    f.error_message = error
-                break
+        f = session.files_by_id.get(file_id)
+        if f:
+            f.status = status
+            if error:
+                f.error_message = error
         self.update_session(session)
+        self._notify_file(session, file_id)
         return session
     
     def update_file_info(
@@ -160,11 +749,11 @@ class SessionManager:
         file_info: FileInfo
     ) -> Session:
         """更新文件基本信息"""
-        for f in session.files:
-            if f.file_id == file_id:
-                f.file_info = file_info
-                break
+        f = session.files_by_id.get(file_id)
+        if f:
+            f.file_info = file_info
         self.update_session(session)
+        self._notify_file(session, file_id)
         return session
     
     def update_file_progress(
@@ -174,11 +763,11 @@ class SessionManager:
         progress: ProcessingProgress
     ) -> Session:
         """更新文件处理进度"""
-        for f in session.files:
-            if f.file_id == file_id:
-                f.progress = progress
-                break
+        f = session.files_by_id.get(file_id)
+        if f:
+            f.progress = progress
         self.update_session(session)
+        self._notify_file(session, file_id)
         return session
     
     def add_file_log(
@@ -187,120 +776,133 @@ class SessionManager:
         file_id: str,
         log_message: str
     ) -> Session:
-        """添加处理日志"""
-        for f in session.files:
-            if f.file_id == file_id:
-                if f.progress is None:
-                    f.progress = ProcessingProgress()
-                # 添加时间戳
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                f.progress.logs.append(f"[{timestamp}] {log_message}")
-                # 只保留最近50条日志
-                if len(f.progress.logs) > 50:
-                    f.progress.logs = f.progress.logs[-50:]
-                break
-        self.update_session(session)
+        """
+        添加处理日志
+        日志只追加到 {session_id}.logs.jsonl，不重写整个会话文件；
+        在事件循环中调用时先缓存在内存，随合并写入一起在线程中追加
+        """
+        f = session.files_by_id.get(file_id)
+        if f:
+            if f.progress is None:
+                f.progress = ProcessingProgress()
+            # 添加时间戳
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            log = f"[{timestamp}] {log_message}"
+            # 定长缓冲，只保留最近 50 条日志
+            f.progress.logs.append(log)
+            
+            line = orjson.dumps({"file_id": file_id, "log": log}) + b"\n"
+            if self._schedule_flush():
+                self._pending_logs.setdefault(session.session_id, []).append(line)
+            else:
+                self._append_logs(session.session_id, [line], self._logs_keep(session))
+        
+        # 内存中的会话仍需标记更新（状态缓存以版本号判断是否变化）
+        session.updated_at = datetime.now().isoformat()
+        session.touch()
+        self._notify_file(session, file_id)
         return session
     
     def add_table_knowledge(self, session: Session, knowledge: TableKnowledge) -> Session:
         """添加表知识库"""
+        knowledge.invalidate_cache()
         session.tables.append(knowledge)
+        session.tables_by_id[knowledge.table_id] = knowledge
+        session.tables_by_file_id.setdefault(knowledge.file_id, []).append(knowledge)
+        session.tables_changed()
         self.update_session(session)
         return session
     
     def get_all_knowledge(self, session: Session) -> List[Dict[str, Any]]:
         """获取会话的所有知识库"""
-        return [t.model_dump() for t in session.tables]
+        return [t.cached_dump() for t in session.tables]
     
     def delete_file(self, session: Session, file_id: str) -> Session:
         """删除文件记录"""
-        import os
-        for f in session.files:
-            if f.file_id == file_id:
-                # 删除物理文件
-                if os.path.exists(f.stored_path):
-                    try:
-                        os.remove(f.stored_path)
-                    except Exception as e:
-                        print(f"删除文件失败: {e}")
-                break
-        
-        session.files = [f for f in session.files if f.file_id != file_id]
+        f = session.files_by_id.pop(file_id, None)
+        if f is not None:
+            # 删除物理文件
+            self._discard(Path(f.stored_path))
+            session.files = [f for f in session.files if f.file_id != file_id]
         self.update_session(session)
+        self._notify_file(session, file_id)
         return session
     
     def delete_table(self, session: Session, table_id: str) -> Session:
         """删除表知识库"""
-        session.tables = [t for t in session.tables if t.table_id != table_id]
+        table = session.tables_by_id.pop(table_id, None)
+        if table is not None:
+            session.tables = [t for t in session.tables if t.table_id != table_id]
+            file_tables = session.tables_by_file_id.get(table.file_id, [])
+            file_tables[:] = [t for t in file_tables if t.table_id != table_id]
+            if not file_tables:
+                session.tables_by_file_id.pop(table.file_id, None)
+            session.tables_changed()
         self.update_session(session)
         return session
     
     def clear_session(self, session: Session) -> Session:
         """清空会话的所有文件和表"""
-        import shutil
-        
         # 删除上传目录
-        session_upload_dir = self.uploads_dir / session.session_id
-        if session_upload_dir.exists():
-            try:
-                shutil.rmtree(session_upload_dir)
-            except Exception as e:
-                print(f"删除上传目录失败: {e}")
+        self._upload_dirs.discard(session.session_id)
+        self._discard(self.uploads_dir / session.session_id)
         
+        self._pending_logs.pop(session.session_id, None)
+        self._get_logs_path(session.session_id).unlink(missing_ok=True)
+        
+        removed_file_ids = [f.file_id for f in session.files]
         session.files = []
         session.tables = []
+        session.reindex()
         self.update_session(session)
+        for file_id in removed_file_ids:
+            self._notify_file(session, file_id)
         return session
     
     def delete_session(self, session_id: str) -> bool:
         """完全删除会话"""
-        import shutil
-        
-        # 从内存移除
-        if session_id in self._sessions:
-            del self._sessions[session_id]
+        # 从内存移除（同时取消待写入，避免删除后又被写回）
+        self._sessions.pop(session_id, None)
+        self._dirty.discard(session_id)
+        self._pending_logs.pop(session_id, None)
+        if self._flush_task is not None and not self._flush_task.done():
+            self._deleted.add(session_id)
+        # 通知订阅者会话已删除（None 为结束信号），让状态推送流结束
+        for queue in self._subscribers.pop(session_id, ()):
+            queue.put_nowait(None)
         
         # 删除会话文件
-        session_file = self.sessions_dir / f"{session_id}.json"
-        if session_file.exists():
-            try:
-                session_file.unlink()
-            except Exception as e:
-                print(f"删除会话文件失败: {e}")
-                return False
+        session_file = self._session_path(session_id)
+        self._session_paths.pop(session_id, None)
+        try:
+            session_file.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"删除会话文件失败: {e}")
+            return False
+        
+        self._get_logs_path(session_id).unlink(missing_ok=True)
+        self._remove_summary(session_id)
         
         # 删除上传目录
-        session_upload_dir = self.uploads_dir / session_id
-        if session_upload_dir.exists():
-            try:
-                shutil.rmtree(session_upload_dir)
-            except Exception as e:
-                print(f"删除上传目录失败: {e}")
+        self._upload_dirs.discard(session_id)
+        self._discard(self.uploads_dir / session_id)
         
         return True
     
     def get_upload_path(self, session_id: str, filename: str) -> Path:
         """获取文件上传路径"""
         session_upload_dir = self.uploads_dir / session_id
-        session_upload_dir.mkdir(parents=True, exist_ok=True)
+        if session_id not in self._upload_dirs:
+            session_upload_dir.mkdir(parents=True, exist_ok=True)
+            self._upload_dirs.add(session_id)
         return session_upload_dir / filename
     
     def list_sessions(self) -> List[Dict[str, Any]]:
-        """列出所有会话"""
-        sessions = []
-        for session_file in self.sessions_dir.glob("*.json"):
-            try:
-                with open(session_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                sessions.append({
-                    "session_id": data["session_id"],
-                    "created_at": data["created_at"],
-                    "updated_at": data["updated_at"],
-                    "file_count": len(data.get("files", [])),
-                    "table_count": len(data.get("tables", [])),
-                })
-            except Exception as e:
-                print(f"读取会话文件失败 {session_file}: {e}")
+        """列出所有会话（从索引读取）"""
+        with self._summaries_lock:
+            sessions = [dict(summary) for summary in self._get_summaries().values()]
         return sorted(sessions, key=lambda x: x["updated_at"], reverse=True)
 
 
@@ -4,13 +4,13 @@ Agent 事件管理器
 """
 import asyncio
 import time
-from typing import Dict, Any, Optional, Callable, List
+from typing import Dict, Any, Optional, Callable, List, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 import uuid
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentEvent:
     """Agent 事件"""
     agent_id: str           # 唯一标识 (如 "research_0", "chart_1")
@@ -38,6 +38,11 @@ class AgentEventManager:
     
     _instance = None
     
+    # 事件队列闲置超过该时长（秒）后由清理任务回收
+    QUEUE_IDLE_TTL = 30 * 60
+    # 清理任务的检查间隔（秒）
+    SWEEP_INTERVAL = 60
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -51,62 +56,116 @@ class AgentEventManager:
         
         # 每个 session 的事件队列
         self._queues: Dict[str, asyncio.Queue] = {}
-        # 当前活跃的 agents
-        self._active_agents: Dict[str, Dict[str, Any]] = {}
-        # Agent ID 计数器
-        self._agent_counters: Dict[str, int] = {}
-        # 锁
-        self._lock = asyncio.Lock()
+        # 每个 session 队列最近一次使用的时间（monotonic）
+        self._queue_last_used: Dict[str, float] = {}
+        # 当前活跃的 agents {session_id: {agent_id: info}}
+        self._active_agents: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Agent ID 计数器 {(session_id, agent_type): count}，按会话隔离，会话结束时由 reset_counters 清理
+        self._agent_counters: Dict[Tuple[str, str], int] = {}
+        # 闲置队列清理任务（有队列时才运行）
+        self._sweeper: Optional[asyncio.Task] = None
     
     def get_queue(self, session_id: str) -> asyncio.Queue:
         """获取或创建 session 的事件队列"""
-        if session_id not in self._queues:
-            self._queues[session_id] = asyncio.Queue()
-        return self._queues[session_id]
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = asyncio.Queue()
+            self._ensure_sweeper()
+        self._queue_last_used[session_id] = time.monotonic()
+        return queue
+    
+    def touch_queue(self, session_id: str):
+        """消费者仍在线（如监控流发送心跳）时调用，避免队列被当作闲置回收"""
+        if session_id in self._queues:
+            self._queue_last_used[session_id] = time.monotonic()
+    
+    def has_queue(self, session_id: str) -> bool:
+        """session 是否有事件订阅者（监控流）"""
+        return session_id in self._queues
+    
+    def emit_nowait(self, event: AgentEvent):
+        """
+        同步投递事件到队列（队列无界，put_nowait 不会阻塞）
+        仅用于不影响活跃 agents 状态的事件（如合并后的 chunk）
+        """
+        queue = self._queues.get(event.session_id)
+        if queue is not None:
+            self._queue_last_used[event.session_id] = time.monotonic()
+            queue.put_nowait(event)
     
     def remove_queue(self, session_id: str):
         """移除 session 的事件队列"""
-        if session_id in self._queues:
-            del self._queues[session_id]
+        self._queues.pop(session_id, None)
+        self._queue_last_used.pop(session_id, None)
+    
+    def _ensure_sweeper(self):
+        """按需启动闲置队列清理任务"""
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._sweeper = loop.create_task(self._sweep_idle_queues())
+    
+    async def _sweep_idle_queues(self):
+        """定期回收闲置超时的队列及其会话状态，队列全部移除后退出"""
+        while self._queues:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            deadline = time.monotonic() - self.QUEUE_IDLE_TTL
+            for session_id, last_used in list(self._queue_last_used.items()):
+                if last_used < deadline:
+                    self.remove_queue(session_id)
+                    self.reset_counters(session_id)
     
-    def generate_agent_id(self, agent_type: str) -> str:
-        """生成唯一的 Agent ID"""
-        if agent_type not in self._agent_counters:
-            self._agent_counters[agent_type] = 0
-        self._agent_counters[agent_type] += 1
-        return f"{agent_type}_{self._agent_counters[agent_type]}"
+    def generate_agent_id(self, agent_type: str, session_id: str = "") -> str:
+        """生成会话内唯一的 Agent ID"""
+        key = (session_id, agent_type)
+        count = self._agent_counters.get(key, 0) + 1
+        self._agent_counters[key] = count
+        return f"{agent_type}_{count}"
     
     def reset_counters(self, session_id: str = None):
-        """重置 Agent 计数器"""
-        self._agent_counters = {}
-        if session_id:
-            self._active_agents = {k: v for k, v in self._active_agents.items() 
-                                   if v.get("session_id") != session_id}
+        """
+        重置 Agent 计数器和活跃 agents
+        指定 session_id 时只清理该会话（会话结束时调用），否则全部清空
+        """
+        if session_id is None:
+            self._agent_counters.clear()
+            self._active_agents.clear()
+            return
+        self._agent_counters = {k: v for k, v in self._agent_counters.items() if k[0] != session_id}
+        self._active_agents.pop(session_id, None)
     
     async def emit(self, event: AgentEvent):
         """发射事件到对应的队列"""
         session_id = event.session_id
-        if session_id and session_id in self._queues:
-            await self._queues[session_id].put(event)
+        queue = self._queues.get(session_id) if session_id else None
+        if queue is not None:
+            self._queue_last_used[session_id] = time.monotonic()
+            await queue.put(event)
         
         # 更新活跃 agents
         if event.event_type == "start":
-            self._active_agents[event.agent_id] = {
+            self._active_agents.setdefault(session_id, {})[event.agent_id] = {
                 "agent_type": event.agent_type,
                 "agent_label": event.agent_label,
                 "status": "running",
                 "session_id": session_id,
             }
         elif event.event_type in ("complete", "error"):
-            if event.agent_id in self._active_agents:
-                self._active_agents[event.agent_id]["status"] = event.event_type
+            agent = self._active_agents.get(session_id, {}).get(event.agent_id)
+            if agent is not None:
+                agent["status"] = event.event_type
     
     def get_active_agents(self, session_id: str = None) -> Dict[str, Dict[str, Any]]:
         """获取活跃的 Agents"""
         if session_id:
-            return {k: v for k, v in self._active_agents.items() 
-                    if v.get("session_id") == session_id}
-        return self._active_agents.copy()
+            return dict(self._active_agents.get(session_id, {}))
+        agents = {}
+        for session_agents in self._active_agents.values():
+            agents.update(session_agents)
+        return agents
 
 
 # 全局单例
@@ -116,6 +175,9 @@ agent_event_manager = AgentEventManager()
 class AgentContext:
     """Agent 上下文管理器 - 用于自动发送 start/complete 事件"""
     
+    # chunk 合并窗口（秒）：窗口内的 token 合并为一个 chunk 事件投递
+    CHUNK_FLUSH_DELAY = 0.05
+    
     def __init__(
         self,
         agent_type: str,
@@ -126,8 +188,14 @@ class AgentContext:
         self.agent_type = agent_type
         self.agent_label = agent_label
         self.session_id = session_id
-        self.agent_id = agent_id or agent_event_manager.generate_agent_id(agent_type)
+        self.agent_id = agent_id or agent_event_manager.generate_agent_id(agent_type, session_id)
         self.start_time = None
+        # 待合并的 chunk 内容及其类型
+        self._chunk_buffer: List[str] = []
+        self._chunk_type: Optional[str] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # 已在 request 事件中发送过的消息条数（对话消息列表只追加，后续只发送新增部分）
+        self._request_emitted = 0
     
     async def __aenter__(self):
         self.start_time = time.time()
@@ -149,6 +217,8 @@ class AgentContext:
     
     async def emit(self, event_type: str, data: Dict[str, Any]):
         """发射事件 - 确保不影响主流程"""
+        # 先投递缓冲中的 chunk，保证事件顺序
+        self._flush_chunks()
         try:
             event = AgentEvent(
                 agent_id=self.agent_id,
@@ -165,10 +235,18 @@ class AgentContext:
             print(f"[AgentEvent] 发射事件失败: {e}")
     
     async def emit_request(self, messages: List[Dict[str, Any]]):
-        """发射请求事件 - 完整内容"""
-        # 显示所有 messages，不截断
+        """
+        发射请求事件 - 只包含上次 request 事件之后新增的消息（内容不截断）
+        messages_count 为完整消息数，start_index 为本次第一条消息的下标
+        """
+        start = self._request_emitted
+        if start > len(messages):
+            # 消息列表被重建（变短），从头发送
+            start = 0
+        self._request_emitted = len(messages)
+        
         simplified = []
-        for msg in messages:
+        for msg in messages[start:]:
             role = msg.get("role", "unknown")
             content = msg.get("content", "")
             tool_calls = msg.get("tool_calls", [])
@@ -179,15 +257,46 @@ class AgentContext:
         
         await self.emit("request", {
             "messages_count": len(messages),
-            "messages": simplified,  # 完整消息列表
+            "start_index": start,
+            "messages": simplified,  # 新增消息
         })
     
     async def emit_chunk(self, chunk: str, chunk_type: str = "content"):
         """发射 chunk 事件 - 完整内容"""
-        await self.emit("chunk", {
-            "content": chunk,
-            "type": chunk_type,
-        })
+        # chunk 事件不影响活跃 agents 状态，没有监控流订阅时直接跳过，不构建事件对象
+        if not agent_event_manager.has_queue(self.session_id):
+            return
+        # 类型切换（如 reasoning -> content）时先投递已缓冲的内容
+        if chunk_type != self._chunk_type:
+            self._flush_chunks()
+            self._chunk_type = chunk_type
+        self._chunk_buffer.append(chunk)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.CHUNK_FLUSH_DELAY, self._flush_chunks
+            )
+    
+    def _flush_chunks(self):
+        """将缓冲的 chunk 合并为一个事件投递"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._chunk_buffer:
+            return
+        content = "".join(self._chunk_buffer)
+        self._chunk_buffer.clear()
+        try:
+            agent_event_manager.emit_nowait(AgentEvent(
+                agent_id=self.agent_id,
+                agent_type=self.agent_type,
+                agent_label=self.agent_label,
+                event_type="chunk",
+                timestamp=datetime.now().isoformat(),
+                data={"content": content, "type": self._chunk_type},
+                session_id=self.session_id,
+            ))
+        except Exception as e:
+            print(f"[AgentEvent] 发射事件失败: {e}")
     
     async def emit_response(self, content: str = None, tool_calls: List = None):
         """发射响应事件 - 完整内容"""
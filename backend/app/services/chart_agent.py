@@ -2,13 +2,23 @@
 图表配置生成服务
 基于 Chart Agent prompt 生成图表配置
 """
+import re
 import json
+import heapq
+import orjson
 from typing import Dict, List, Any, Optional
 from ..llm import llm_client
 from ..models.session import Session
 from .agent_events import AgentContext, agent_event_manager
 
 
+# _parse_chart_json 使用的正则（模块加载时编译一次）
+_RE_JSON_OBJECT = re.compile(r'\{[\s\S]*\}')
+_RE_TRAILING_COMMA_OBJ = re.compile(r',\s*}')
+_RE_TRAILING_COMMA_ARR = re.compile(r',\s*]')
+_RE_CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]')
+
+
 CHART_SYSTEM_PROMPT = """你是图表配置专家。根据数据和分析需求，选择最佳图表类型并生成配置。
 
 # 支持的图表类型
@@ -242,14 +252,14 @@ class ChartAgent:
         dimensions = []
         metrics = []
         
+        head = query_results[:10]
         for field in fields:
-            values = [r.get(field) for r in query_results[:10]]
-            non_null = [v for v in values if v is not None]
+            # 按前 10 行中第一个非空值判断类型（找到即停止，不构建中间列表）
+            first_val = next((v for v in (r.get(field) for r in head) if v is not None), None)
             
-            if not non_null:
+            if first_val is None:
                 continue
             
-            first_val = non_null[0]
             if isinstance(first_val, (int, float)):
                 metrics.append(field)
             else:
@@ -291,22 +301,18 @@ class ChartAgent:
             y_axis = ds.get("y_axis", [])
             filter_config = ds.get("filter", {})
             
-            # 应用过滤
-            data = full_data.copy()
+            # 应用过滤（full_data 只读，不需要过滤时直接引用，不复制）
+            data = full_data
             
             # TOP N 过滤
-            if filter_config.get("top"):
+            if filter_config.get("top") and y_axis:
                 top_n = filter_config["top"]
                 order = filter_config.get("order", "desc")
                 
-                # 按第一个 Y 轴字段排序
-                if y_axis:
-                    sort_field = y_axis[0]
-                    data.sort(
-                        key=lambda x: x.get(sort_field, 0) or 0,
-                        reverse=(order == "desc")
-                    )
-                    data = data[:top_n]
+                # 按第一个 Y 轴字段取前 N 条（部分排序，返回新列表，与完整排序后切片结果一致）
+                sort_field = y_axis[0]
+                select = heapq.nlargest if order == "desc" else heapq.nsmallest
+                data = select(top_n, full_data, key=lambda x: x.get(sort_field, 0) or 0)
             
             ds["rendered_data"] = data
         
@@ -316,39 +322,45 @@ class ChartAgent:
         """
         增强版 JSON 解析（多重清理）
         """
-        import re
-        
         if not content:
             return {"error": "空内容"}
         
-        # 提取 JSON 块
+        # 提取 JSON 块：取第一个代码块起始标记之后、下一个 ``` 之前的内容（按下标切片，不做整串 split）
         json_str = content
-        if "```json" in content:
-            parts = content.split("```json")
-            if len(parts) > 1:
-                json_str = parts[1].split("```")[0]
-        elif "```" in content:
-            parts = content.split("```")
-            if len(parts) > 1:
-                json_str = parts[1].split("```")[0] if len(parts) > 2 else parts[1]
+        start = content.find("```json")
+        if start != -1:
+            start += len("```json")
+        else:
+            start = content.find("```")
+            if start != -1:
+                start += len("```")
+        if start != -1:
+            end = content.find("```", start)
+            json_str = content[start:end] if end != -1 else content[start:]
         
         # 查找 JSON 对象
         json_str = json_str.strip()
         if not json_str.startswith("{"):
-            match = re.search(r'\{[\s\S]*\}', json_str)
+            match = _RE_JSON_OBJECT.search(json_str)
             if match:
                 json_str = match.group()
         
         # 清理常见问题
         json_str = json_str.strip()
         # 移除尾部多余逗号
-        json_str = re.sub(r',\s*}', '}', json_str)
-        json_str = re.sub(r',\s*]', ']', json_str)
+        json_str = _RE_TRAILING_COMMA_OBJ.sub('}', json_str)
+        json_str = _RE_TRAILING_COMMA_ARR.sub(']', json_str)
         # 修复未转义的引号
         json_str = json_str.replace('\\"', '"').replace('""', '"')
         # 移除控制字符
-        json_str = re.sub(r'[\x00-\x1f\x7f]', '', json_str)
+        json_str = _RE_CONTROL_CHARS.sub('', json_str)
+        
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            pass
         
+        # orjson 更严格（如不接受 NaN），失败时回退到标准库
         try:
             return json.loads(json_str)
         except json.JSONDecodeError as e:
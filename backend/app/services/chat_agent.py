@@ -3,14 +3,112 @@
 负责处理用户问答和数据分析请求
 """
 import re
-import json
+import asyncio
+from itertools import islice
 from typing import Dict, List, Any, Optional, AsyncGenerator
+
+import orjson
+
 from ..models.session import Session, session_manager
 from ..llm import llm_client
 from .context_builder import context_builder
 from .data_executor import data_executor
 
 
+# 回复中的 SQL 代码块
+_RE_SQL_BLOCK = re.compile(r'```sql\s*([\s\S]*?)```', re.IGNORECASE)
+
+
+# orjson 缩进输出（C 实现；标准库 json 指定 indent 时走纯 Python 编码路径）
+_ORJSON_PRETTY = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _dumps_rows(rows: List[Dict[str, Any]]) -> str:
+    """将查询结果行序列化为缩进 JSON 文本（用于提示词）"""
+    return orjson.dumps(rows, default=str, option=_ORJSON_PRETTY).decode()
+
+
+# 查询结果分析提示词模板（_analyze_query_result 与 _analyze_query_result_stream 共用）
+ANALYSIS_PROMPT_TMPL = """基于以下查询结果，请给出简洁的数据分析和洞察：
+
+用户问题: {user_question}
+
+执行的 SQL:
+```sql
+{sql}
+```
+
+查询结果 ({row_count} 行):
+```json
+{rows_json}
+```
+{truncation_note}
+
+请用中文给出：
+1. 结果摘要（1-2句话）
+2. 关键发现（如果有）
+3. 建议的后续分析（如果需要）
+
+保持简洁，不要重复 SQL 语句。"""
+
+# 提示词中最多展示的结果行数
+ANALYSIS_MAX_ROWS = 20
+
+
+def _build_analysis_prompt(user_question: str, sql_result: Dict[str, Any]) -> str:
+    """构建查询结果分析提示词（sql_result["data"] 不能为空）"""
+    data = sql_result["data"]
+    return ANALYSIS_PROMPT_TMPL.format(
+        user_question=user_question,
+        sql=sql_result["sql"],
+        row_count=data["row_count"],
+        rows_json=_dumps_rows(data["data"][:ANALYSIS_MAX_ROWS]),
+        truncation_note=(
+            f"(显示前 {ANALYSIS_MAX_ROWS} 行，共 {data['total_count']} 行)"
+            if data.get("truncated") else ""
+        ),
+    )
+
+
+class _SqlFenceScanner:
+    """
+    流式输出中增量检测第一个 SQL 代码块（与 _RE_SQL_BLOCK 的首个匹配一致）
+    只从上次检查的位置继续查找，不重复扫描已处理的内容
+    """
+    
+    def __init__(self):
+        self.done = False
+        self._scan_from = 0
+        self._sql_start = -1  # ```sql 之后的位置
+    
+    def feed(self, content: str) -> Optional[str]:
+        """传入当前累积的完整内容；代码块闭合时返回其中的 SQL（只返回一次）"""
+        if self._sql_start < 0:
+            idx = content.find("```", self._scan_from)
+            while idx != -1:
+                tag = content[idx + 3:idx + 6]
+                if len(tag) < 3:
+                    # 语言标记尚未完整到达，下次从这里继续
+                    self._scan_from = idx
+                    return None
+                if tag.lower() == "sql":
+                    self._sql_start = self._scan_from = idx + 6
+                    break
+                idx = content.find("```", idx + 1)
+            else:
+                # 末尾可能是被拆开的 ``
+                self._scan_from = max(0, len(content) - 2)
+                return None
+        
+        end = content.find("```", self._scan_from)
+        if end == -1:
+            self._scan_from = max(self._sql_start, len(content) - 2)
+            return None
+        
+        self.done = True
+        return content[self._sql_start:end].strip()
+
+
 class ChatAgent:
     """对话 Agent - 处理用户问答"""
     
@@ -25,6 +123,23 @@ SELECT ...
 系统会自动检测并执行 SQL，将结果返回给你分析。
 """
     
+    # 最多保留的历史消息条数
+    MAX_HISTORY_MESSAGES = 10
+    
+    def _build_messages(
+        self,
+        session: Session,
+        user_message: str,
+        history: Optional[List[Dict[str, str]]],
+    ) -> List[Dict[str, Any]]:
+        """构建消息列表：系统提示词 + 最近的历史消息 + 用户消息（一次性构建，不逐条 append）"""
+        system_msg = {"role": "system", "content": context_builder.build_system_prompt(session)}
+        user_msg = {"role": "user", "content": user_message}
+        if not history:
+            return [system_msg, user_msg]
+        start = max(0, len(history) - self.MAX_HISTORY_MESSAGES)
+        return [system_msg, *islice(history, start, None), user_msg]
+    
     async def chat(
         self,
         session: Session,
@@ -49,26 +164,14 @@ SELECT ...
                 "error": "错误信息（如果有）"
             }
         """
-        history = history or []
-        
-        # 构建系统提示词
-        system_prompt = context_builder.build_system_prompt(session)
-        
-        # 构建消息列表
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # 添加历史消息
-        for msg in history[-10:]:  # 最多保留最近10轮对话
-            messages.append(msg)
-        
-        # 添加用户消息
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(session, user_message, history)
         
-        # 调用 LLM
+        # 调用 LLM（相同上下文与问题的重复提问直接命中响应缓存；SQL 仍会重新执行，数据保持最新）
         result = await llm_client.chat(
             messages=messages,
             agent_name="data",
             stream=False,
+            cache=True,
         )
         
         response_content = result.get("content", "")
@@ -126,58 +229,55 @@ SELECT ...
             {"type": "error", "error": "..."} - 错误信息
             {"type": "done"} - 完成
         """
-        history = history or []
-        
-        # 构建系统提示词
-        system_prompt = context_builder.build_system_prompt(session)
-        
-        # 构建消息列表
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # 添加历史消息
-        for msg in history[-10:]:
-            messages.append(msg)
-        
-        # 添加用户消息
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(session, user_message, history)
         
         # 流式调用 LLM
         full_content = ""
         full_thinking = ""
         is_thinking = False
+        # 第一个 SQL 代码块闭合后立即推送并在线程中执行，与 LLM 后续输出并行
+        sql_scanner = _SqlFenceScanner()
+        sql_task: Optional[asyncio.Task] = None
         
-        async for chunk in await llm_client.chat(
-            messages=messages,
-            agent_name="data",
-            stream=True,
-        ):
-            chunk_type = chunk.get("type", "content")
-            chunk_content = chunk.get("content", "")
+        try:
+            async for chunk in await llm_client.chat(
+                messages=messages,
+                agent_name="data",
+                stream=True,
+            ):
+                chunk_type = chunk.get("type", "content")
+                chunk_content = chunk.get("content", "")
+                
+                if chunk_type == "thinking":
+                    if not is_thinking:
+                        is_thinking = True
+                        yield {"type": "thinking_start"}
+                    full_thinking += chunk_content
+                    yield {"type": "thinking", "content": chunk_content}
+                else:
+                    if is_thinking:
+                        is_thinking = False
+                        yield {"type": "thinking_end"}
+                    full_content += chunk_content
+                    yield {"type": "content", "content": chunk_content}
+                    if not sql_scanner.done:
+                        sql = sql_scanner.feed(full_content)
+                        if sql:
+                            sql_task = asyncio.create_task(self._execute_sql(session, sql))
+                            yield {"type": "sql", "sql": sql}
+                            yield {"type": "sql_executing"}
             
-            if chunk_type == "thinking":
-                if not is_thinking:
-                    is_thinking = True
-                    yield {"type": "thinking_start"}
-                full_thinking += chunk_content
-                yield {"type": "thinking", "content": chunk_content}
-            else:
-                if is_thinking:
-                    is_thinking = False
-                    yield {"type": "thinking_end"}
-                full_content += chunk_content
-                yield {"type": "content", "content": chunk_content}
-        
-        # 确保思考结束标记已发送
-        if is_thinking:
-            yield {"type": "thinking_end"}
-        
-        # 检查是否包含 SQL
-        sql_result = await self._detect_and_execute_sql(session, full_content)
+            # 确保思考结束标记已发送
+            if is_thinking:
+                yield {"type": "thinking_end"}
+            
+            # 流式过程中已开始执行的 SQL，等待结果
+            sql_result = await sql_task if sql_task is not None else {"executed": False}
+        finally:
+            if sql_task is not None and not sql_task.done():
+                sql_task.cancel()
         
         if sql_result["executed"]:
-            yield {"type": "sql", "sql": sql_result["sql"]}
-            yield {"type": "sql_executing"}
-            
             if sql_result["data"]:
                 yield {"type": "data", "data": sql_result["data"]}
             
@@ -213,21 +313,22 @@ SELECT ...
                 "error": str
             }
         """
-        # 提取 SQL 代码块
-        sql_pattern = r'```sql\s*([\s\S]*?)```'
-        matches = re.findall(sql_pattern, content, re.IGNORECASE)
-        
-        if not matches:
-            return {"executed": False, "sql": None, "data": None}
-        
-        # 执行第一个 SQL
-        sql = matches[0].strip()
-        
+        sql = self._extract_sql(content)
         if not sql:
             return {"executed": False, "sql": None, "data": None}
-        
-        # 执行查询
-        success, data, message = data_executor.execute_sql(session, sql)
+        return await self._execute_sql(session, sql)
+    
+    @staticmethod
+    def _extract_sql(content: str) -> Optional[str]:
+        """提取内容中第一个完整的 SQL 代码块，没有时返回 None"""
+        match = _RE_SQL_BLOCK.search(content)
+        if not match:
+            return None
+        return match.group(1).strip() or None
+    
+    async def _execute_sql(self, session: Session, sql: str) -> Dict[str, Any]:
+        """在线程中执行 SQL（pandasql 查询是同步阻塞的）"""
+        success, data, message = await asyncio.to_thread(data_executor.execute_sql, session, sql)
         
         return {
             "executed": True,
@@ -264,33 +365,15 @@ SELECT ...
             return None
         
         # 构建分析请求
-        prompt = f"""基于以下查询结果，请给出简洁的数据分析和洞察：
-
-用户问题: {user_question}
-
-执行的 SQL:
-```sql
-{sql_result['sql']}
-```
-
-查询结果 ({data['row_count']} 行):
-```json
-{json.dumps(data['data'][:20], ensure_ascii=False, indent=2)}
-```
-{f"(显示前 20 行，共 {data['total_count']} 行)" if data.get('truncated') else ""}
-
-请用中文给出：
-1. 结果摘要（1-2句话）
-2. 关键发现（如果有）
-3. 建议的后续分析（如果需要）
-
-保持简洁，不要重复 SQL 语句。"""
+        prompt = _build_analysis_prompt(user_question, sql_result)
         
         try:
+            # 提示词包含 SQL 与查询结果，结果相同时复用缓存的分析
             result = await llm_client.chat(
                 messages=[{"role": "user", "content": prompt}],
                 agent_name="data",
                 stream=False,
+                cache=True,
             )
             return result.get("content", "")
         except Exception as e:
@@ -320,27 +403,7 @@ SELECT ...
             return
         
         # 构建分析请求
-        prompt = f"""基于以下查询结果，请给出简洁的数据分析和洞察：
-
-用户问题: {user_question}
-
-执行的 SQL:
-```sql
-{sql_result['sql']}
-```
-
-查询结果 ({data['row_count']} 行):
-```json
-{json.dumps(data['data'][:20], ensure_ascii=False, indent=2)}
-```
-{f"(显示前 20 行，共 {data['total_count']} 行)" if data.get('truncated') else ""}
-
-请用中文给出：
-1. 结果摘要（1-2句话）
-2. 关键发现（如果有）
-3. 建议的后续分析（如果需要）
-
-保持简洁，不要重复 SQL 语句。"""
+        prompt = _build_analysis_prompt(user_question, sql_result)
         
         try:
             async for chunk in await llm_client.chat(
@@ -2,10 +2,23 @@
 知识库上下文构建服务
 负责将知识库信息构建成 LLM 可理解的上下文
 """
+import io
+from itertools import islice
 from typing import Dict, List, Any, Optional
+
+import orjson
+
 from ..models.session import Session, TableKnowledge
 
 
+# 样本数据的缩进 JSON 输出（orjson 的 C 实现，不转义中文，与 json.dumps(ensure_ascii=False, indent=2) 格式一致）
+_ORJSON_PRETTY = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# _build_single_table_context 的字段表格表头与行模板（每行以换行开头）
+_FIELD_TABLE_HEADER = "\n\n**字段列表:**\n| 字段名 | 类型 | 描述 | 样本值 |\n|--------|------|------|--------|"
+_FIELD_ROW_TMPL = "\n| `{name}` | {dtype} | {desc} | {samples} |"
+
+
 class ContextBuilder:
     """上下文构建器 - 将知识库转换为 LLM 上下文"""
     
@@ -29,6 +42,22 @@ class ContextBuilder:
         if not session.tables:
             return self._build_empty_context_prompt()
         
+        # 表未变化时直接复用已构建的提示词
+        key = ("system_prompt", session.tables_version, include_samples, max_columns_per_table)
+        prompt = session.context_cache.get(key)
+        if prompt is None:
+            prompt = session.context_cache[key] = self._build_system_prompt(
+                session, include_samples, max_columns_per_table
+            )
+        return prompt
+    
+    def _build_system_prompt(
+        self,
+        session: Session,
+        include_samples: bool,
+        max_columns_per_table: int
+    ) -> str:
+        """构建包含知识库信息的系统提示词（不使用缓存）"""
         # 构建表信息
         tables_context = self._build_tables_context(
             session.tables, 
@@ -108,60 +137,67 @@ LIMIT n
         include_samples: bool,
         max_columns: int
     ) -> str:
-        """构建单个表的上下文"""
-        lines = []
+        """构建单个表的上下文（标题行含序号，其余部分按表缓存）"""
+        key = ("table", include_samples, max_columns)
+        body = table.context_cache.get(key)
+        if body is None:
+            body = table.context_cache[key] = self._render_table_body(table, include_samples, max_columns)
+        return f"### 表 {index}: `{table.table_name}`{body}"
+    
+    def _render_table_body(
+        self,
+        table: TableKnowledge,
+        include_samples: bool,
+        max_columns: int
+    ) -> str:
+        """渲染表上下文中标题行之后的部分（各行直接写入同一个缓冲区，每行以换行开头）"""
+        buf = io.StringIO()
+        write = buf.write
         
         # 表头信息
-        lines.append(f"### 表 {index}: `{table.table_name}`")
-        lines.append(f"- 来源文件: {table.file_name}")
-        lines.append(f"- 数据量: {table.row_count:,} 行 × {table.column_count} 列")
+        write(f"\n- 来源文件: {table.file_name}")
+        write(f"\n- 数据量: {table.row_count:,} 行 × {table.column_count} 列")
         
         # 表描述
         if table.table_description:
             desc = table.table_description
             if desc.get("description"):
-                lines.append(f"- 描述: {desc['description']}")
+                write(f"\n- 描述: {desc['description']}")
             if desc.get("main_entities"):
-                lines.append(f"- 主要实体: {', '.join(desc['main_entities'])}")
+                write(f"\n- 主要实体: {', '.join(desc['main_entities'])}")
             if desc.get("suggested_analyses"):
-                lines.append(f"- 建议分析: {', '.join(desc['suggested_analyses'][:3])}")
+                write(f"\n- 建议分析: {', '.join(desc['suggested_analyses'][:3])}")
         
         # 字段信息
-        lines.append("\n**字段列表:**")
-        lines.append("| 字段名 | 类型 | 描述 | 样本值 |")
-        lines.append("|--------|------|------|--------|")
-        
-        columns_to_show = table.columns[:max_columns]
-        for col in columns_to_show:
-            name = col["name"]
-            dtype = col.get("inferred_type", "unknown")
-            desc = col.get("description", "-")[:30]
-            
+        write(_FIELD_TABLE_HEADER)
+        
+        for col in table.columns[:max_columns]:
             # 样本值
             samples = col.get("sample_values", [])[:2]
-            sample_str = ", ".join([str(s)[:20] for s in samples]) if samples else "-"
-            
-            lines.append(f"| `{name}` | {dtype} | {desc} | {sample_str} |")
+            write(_FIELD_ROW_TMPL.format(
+                name=col["name"],
+                dtype=col.get("inferred_type", "unknown"),
+                desc=col.get("description", "-")[:30],
+                samples=", ".join([str(s)[:20] for s in samples]) if samples else "-",
+            ))
         
         if len(table.columns) > max_columns:
-            lines.append(f"| ... | ... | 还有 {len(table.columns) - max_columns} 个字段 | ... |")
+            write(f"\n| ... | ... | 还有 {len(table.columns) - max_columns} 个字段 | ... |")
         
         # 样本数据
         if include_samples and table.sample_data:
-            lines.append("\n**样本数据 (前3行):**")
-            lines.append("```json")
-            import json
+            write("\n\n**样本数据 (前3行):**\n```json\n")
             # 只取前3行，每行只取前5个字段
             sample_preview = []
             for row in table.sample_data[:3]:
-                row_preview = {k: v for k, v in list(row.items())[:5]}
+                row_preview = dict(islice(row.items(), 5))
                 if len(row) > 5:
                     row_preview["..."] = f"还有 {len(row) - 5} 个字段"
                 sample_preview.append(row_preview)
-            lines.append(json.dumps(sample_preview, ensure_ascii=False, indent=2))
-            lines.append("```")
+            write(orjson.dumps(sample_preview, default=str, option=_ORJSON_PRETTY).decode())
+            write("\n```")
         
-        return "\n".join(lines)
+        return buf.getvalue()
     
     def build_query_context(
         self, 
@@ -181,13 +217,19 @@ LIMIT n
         if not session.tables:
             return "没有可用的数据表"
         
+        key = ("query_context", session.tables_version)
+        context = session.context_cache.get(key)
+        if context is not None:
+            return context
+        
         lines = ["可用数据表:"]
         
         for table in session.tables:
             lines.append(f"\n表名: {table.table_name}")
             lines.append(f"列: {', '.join([c['name'] for c in table.columns])}")
         
-        return "\n".join(lines)
+        context = session.context_cache[key] = "\n".join(lines)
+        return context
     
     def get_table_schema_for_sql(self, session: Session) -> Dict[str, List[str]]:
         """
@@ -219,73 +261,93 @@ LIMIT n
         if not session.tables:
             return ""
         
-        parts = []
+        key = ("knowledge_context", session.tables_version, max_columns_per_table)
+        context = session.context_cache.get(key)
+        if context is None:
+            context = session.context_cache[key] = self._build_knowledge_context(
+                session, max_columns_per_table
+            )
+        return context
+    
+    def _build_knowledge_context(self, session: Session, max_columns_per_table: int) -> str:
+        """构建报告生成用的知识库上下文（不使用缓存）"""
+        return "\n\n---\n\n".join(
+            self._build_knowledge_table_context(table, max_columns_per_table)
+            for table in session.tables
+        )
+    
+    def _build_knowledge_table_context(self, table: TableKnowledge, max_columns: int) -> str:
+        """单个表的知识库上下文（按表缓存，表内容不变时不重复渲染字段行）"""
+        key = ("knowledge", max_columns)
+        context = table.context_cache.get(key)
+        if context is None:
+            context = table.context_cache[key] = self._render_knowledge_table(table, max_columns)
+        return context
+    
+    def _render_knowledge_table(self, table: TableKnowledge, max_columns: int) -> str:
+        """渲染单个表的知识库上下文"""
+        lines = []
         
-        for table in session.tables:
-            lines = []
-            
-            # 表基本信息
-            lines.append(f"## 表: {table.table_name}")
-            lines.append(f"- 数据量: {table.row_count:,} 行")
-            lines.append(f"- 字段数: {table.column_count} 列")
-            
-            # 表描述
-            if table.table_description:
-                desc = table.table_description
-                if desc.get("description"):
-                    lines.append(f"- 描述: {desc['description']}")
-                if desc.get("key_dimensions"):
-                    lines.append(f"- 关键维度: {', '.join(desc['key_dimensions'])}")
-                if desc.get("key_metrics"):
-                    lines.append(f"- 关键指标: {', '.join(desc['key_metrics'])}")
-            
-            # 字段列表
-            lines.append("\n### 字段")
-            
-            # 分类展示
-            dimensions = []
-            metrics = []
-            others = []
-            
-            for col in table.columns[:max_columns_per_table]:
-                col_info = {
-                    "name": col["name"],
-                    "type": col.get("inferred_type", "unknown"),
-                    "desc": col.get("description", ""),
-                    "samples": col.get("sample_values", [])[:2],
-                }
-                
-                if col.get("is_dimension"):
-                    dimensions.append(col_info)
-                elif col.get("is_metric"):
-                    metrics.append(col_info)
-                else:
-                    others.append(col_info)
-            
-            if dimensions:
-                lines.append("\n**维度字段:**")
-                for col in dimensions:
-                    samples = ", ".join([str(s)[:20] for s in col["samples"]])
-                    lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]} | 样本: {samples}")
-            
-            if metrics:
-                lines.append("\n**指标字段:**")
-                for col in metrics:
-                    samples = ", ".join([str(s)[:20] for s in col["samples"]])
-                    lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]} | 样本: {samples}")
+        # 表基本信息
+        lines.append(f"## 表: {table.table_name}")
+        lines.append(f"- 数据量: {table.row_count:,} 行")
+        lines.append(f"- 字段数: {table.column_count} 列")
+        
+        # 表描述
+        if table.table_description:
+            desc = table.table_description
+            if desc.get("description"):
+                lines.append(f"- 描述: {desc['description']}")
+            if desc.get("key_dimensions"):
+                lines.append(f"- 关键维度: {', '.join(desc['key_dimensions'])}")
+            if desc.get("key_metrics"):
+                lines.append(f"- 关键指标: {', '.join(desc['key_metrics'])}")
+        
+        # 字段列表
+        lines.append("\n### 字段")
+        
+        # 分类展示
+        dimensions = []
+        metrics = []
+        others = []
+        
+        for col in table.columns[:max_columns]:
+            col_info = {
+                "name": col["name"],
+                "type": col.get("inferred_type", "unknown"),
+                "desc": col.get("description", ""),
+                "samples": col.get("sample_values", [])[:2],
+            }
             
-            if others:
-                lines.append("\n**其他字段:**")
-                for col in others[:10]:  # 其他字段只显示前10个
-                    samples = ", ".join([str(s)[:20] for s in col["samples"]])
-                    lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]}")
-                
-                if len(others) > 10:
-                    lines.append(f"- ... 还有 {len(others) - 10} 个字段")
+            if col.get("is_dimension"):
+                dimensions.append(col_info)
+            elif col.get("is_metric"):
+                metrics.append(col_info)
+            else:
+                others.append(col_info)
+        
+        if dimensions:
+            lines.append("\n**维度字段:**")
+            for col in dimensions:
+                samples = ", ".join([str(s)[:20] for s in col["samples"]])
+                lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]} | 样本: {samples}")
+        
+        if metrics:
+            lines.append("\n**指标字段:**")
+            for col in metrics:
+                samples = ", ".join([str(s)[:20] for s in col["samples"]])
+                lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]} | 样本: {samples}")
+        
+        if others:
+            lines.append("\n**其他字段:**")
+            for col in others[:10]:  # 其他字段只显示前10个
+                samples = ", ".join([str(s)[:20] for s in col["samples"]])
+                lines.append(f"- `{col['name']}` ({col['type']}): {col['desc'][:30]}")
             
-            parts.append("\n".join(lines))
+            if len(others) > 10:
+                lines.append(f"- ... 还有 {len(others) - 10} 个字段")
         
-        return "\n\n---\n\n".join(parts)
+        return "\n".join(lines)
 
 
 # 创建单例
@@ -6,11 +6,13 @@
 """
 import re
 import json
+import numpy as np
 import pandas as pd
 from pandasql import sqldf
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 from ..models.session import Session, TableKnowledge, session_manager
+from .data_parser import data_parser
 
 
 def clean_html_and_urls(text: str) -> str:
@@ -68,6 +70,18 @@ def clean_dataframe_html(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def dataframe_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    DataFrame 转为 records 列表，NaN / ±Infinity 统一转为 None
+    在数据产生处清理一次，下游（SSE、报告、API 响应）无需再逐个事件递归清理
+    """
+    if df.empty:
+        return []
+    cleaned = df.replace([np.inf, -np.inf], np.nan)
+    cleaned = cleaned.astype(object).where(cleaned.notna(), None)
+    return cleaned.to_dict(orient='records')
+
+
 class DataExecutor:
     """数据执行器 - 使用 pandasql 执行 SQL 查询"""
     
@@ -99,7 +113,13 @@ class DataExecutor:
                 file_path = session_dir / table.file_name
                 if file_path.exists():
                     try:
-                        df = pd.read_csv(file_path)
+                        # 按解析时识别的编码 / 分隔符读取；旧会话未记录时重新推断
+                        encoding, sep = table.encoding, table.delimiter
+                        if encoding is None or sep is None:
+                            sniffed_encoding, sniffed_sep = data_parser.sniff_format(str(file_path))
+                            encoding = encoding or sniffed_encoding
+                            sep = sep or sniffed_sep
+                        df = pd.read_csv(file_path, encoding=encoding, sep=sep, low_memory=False)
                         self._dataframes[cache_key] = df
                         return df
                     except Exception as e:
@@ -420,7 +440,7 @@ class DataExecutor:
         
         return {
             "columns": result_df.columns.tolist(),
-            "data": result_df.to_dict(orient='records'),
+            "data": dataframe_to_records(result_df),
             "row_count": len(result_df),
             "total_count": original_count,
             "truncated": original_count > max_rows
@@ -655,7 +675,7 @@ class DataExecutor:
         
         return {
             "columns": df.columns.tolist(),
-            "data": df.head(limit).to_dict(orient='records'),
+            "data": dataframe_to_records(df.head(limit)),
             "row_count": limit,
             "total_count": len(df)
         }
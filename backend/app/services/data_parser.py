@@ -2,6 +2,7 @@
 数据解析服务
 负责 CSV 文件的解析、类型推断和统计信息生成
 """
+import csv
 import pandas as pd
 import numpy as np
 from pathlib import Path
@@ -22,35 +23,83 @@ class DataParser:
         r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$',  # 2024-01-01 12:00:00
     ]
     
+    # 编码 / 分隔符嗅探读取的字节数
+    SNIFF_BYTES = 64 * 1024
+    # 候选分隔符
+    SNIFF_DELIMITERS = ",;\t|"
+    
     def __init__(self):
         self.df: Optional[pd.DataFrame] = None
         self.file_path: Optional[str] = None
+        self._null_counts: Optional[pd.Series] = None
+        self._unique_counts: Optional[pd.Series] = None
+    
+    def sniff_format(self, file_path: str) -> Tuple[str, str]:
+        """
+        读取文件头部，一次性推断编码和分隔符
+        
+        Returns:
+            (编码, 分隔符)
+        """
+        with open(file_path, "rb") as f:
+            head = f.read(self.SNIFF_BYTES)
+        
+        encoding = "latin1"
+        for enc in ("utf-8", "gb18030"):
+            try:
+                text = head.decode(enc)
+            except UnicodeDecodeError as e:
+                # 头部截断在多字节字符中间时，只要截断点之前都能解码即可
+                if len(head) == self.SNIFF_BYTES and e.start >= len(head) - 3:
+                    text = head[:e.start].decode(enc, errors="replace")
+                else:
+                    continue
+            encoding = enc
+            break
+        else:
+            text = head.decode(encoding)
+        
+        # 只用前若干行推断分隔符，失败时使用逗号
+        sample = "\n".join(text.splitlines()[:20])
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=self.SNIFF_DELIMITERS).delimiter
+        except csv.Error:
+            delimiter = ","
+        return encoding, delimiter
     
     def parse_csv(
         self, 
         file_path: str, 
-        encoding: str = 'utf-8',
-        sample_rows: int = 1000
+        encoding: Optional[str] = None,
+        sample_rows: int = 1000,
+        sep: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         解析 CSV 文件
         
         Args:
             file_path: CSV 文件路径
-            encoding: 文件编码
+            encoding: 文件编码（为空时根据文件头部推断）
             sample_rows: 用于类型推断的样本行数
+            sep: 分隔符（为空时根据文件头部推断）
         
         Returns:
             解析结果，包含表结构、统计信息等
         """
         self.file_path = file_path
         
-        # 尝试不同编码读取
-        encodings_to_try = [encoding, 'utf-8', 'gbk', 'gb2312', 'latin1']
+        if encoding is None or sep is None:
+            sniffed_encoding, sniffed_sep = self.sniff_format(file_path)
+            encoding = encoding or sniffed_encoding
+            sep = sep or sniffed_sep
+        
+        # 优先使用推断出的编码；头部之后仍出现无法解码的内容时再尝试其他编码
+        encodings_to_try = list(dict.fromkeys([encoding, 'utf-8', 'gb18030', 'latin1']))
         
         for enc in encodings_to_try:
             try:
-                self.df = pd.read_csv(file_path, encoding=enc, low_memory=False)
+                self.df = pd.read_csv(file_path, encoding=enc, sep=sep, low_memory=False)
+                encoding = enc
                 break
             except UnicodeDecodeError:
                 continue
@@ -60,10 +109,16 @@ class DataParser:
         if self.df is None:
             raise ValueError("无法识别文件编码")
         
+        # 空值数 / 唯一值数按整表各算一次，列分析、类型推断、主键检测共用
+        self._null_counts = self.df.isna().sum()
+        self._unique_counts = self.df.nunique()
+        
         # 获取表信息
         result = {
             "file_name": Path(file_path).name,
             "file_path": file_path,
+            "encoding": encoding,
+            "delimiter": sep,
             "row_count": len(self.df),
             "column_count": len(self.df.columns),
             "columns": self._analyze_columns(),
@@ -80,16 +135,20 @@ class DataParser:
         for col in self.df.columns:
             col_data = self.df[col]
             
-            # 推断类型
-            inferred_type, semantic_type = self._infer_column_type(col, col_data)
+            # 统计信息
+            null_count = self._null_counts[col]
+            unique_count = self._unique_counts[col]
             
-            # 获取样本值
+            # 非空值只过滤一次，类型推断与样本值共用
             non_null_values = col_data.dropna()
-            sample_values = non_null_values.head(5).tolist() if len(non_null_values) > 0 else []
             
-            # 统计信息
-            null_count = col_data.isna().sum()
-            unique_count = col_data.nunique()
+            # 推断类型
+            inferred_type, semantic_type = self._infer_column_type(
+                col, col_data, non_null=non_null_values, unique_count=unique_count
+            )
+            
+            # 获取样本值
+            sample_values = non_null_values.head(5).tolist()
             
             column_info = {
                 "name": col,
@@ -107,11 +166,13 @@ class DataParser:
             # 添加数值统计
             if inferred_type in ["integer", "decimal"]:
                 numeric_data = pd.to_numeric(col_data, errors='coerce')
+                col_min, col_max = numeric_data.min(), numeric_data.max()
+                col_mean, col_median = numeric_data.mean(), numeric_data.median()
                 column_info["stats"] = {
-                    "min": float(numeric_data.min()) if not pd.isna(numeric_data.min()) else None,
-                    "max": float(numeric_data.max()) if not pd.isna(numeric_data.max()) else None,
-                    "mean": round(float(numeric_data.mean()), 2) if not pd.isna(numeric_data.mean()) else None,
-                    "median": float(numeric_data.median()) if not pd.isna(numeric_data.median()) else None,
+                    "min": float(col_min) if not pd.isna(col_min) else None,
+                    "max": float(col_max) if not pd.isna(col_max) else None,
+                    "mean": round(float(col_mean), 2) if not pd.isna(col_mean) else None,
+                    "median": float(col_median) if not pd.isna(col_median) else None,
                 }
             
             # 添加分类统计
@@ -126,17 +187,30 @@ class DataParser:
         
         return columns
     
-    def _infer_column_type(self, col_name: str, col_data: pd.Series) -> Tuple[str, str]:
+    def _infer_column_type(
+        self,
+        col_name: str,
+        col_data: pd.Series,
+        non_null: Optional[pd.Series] = None,
+        unique_count: Optional[int] = None
+    ) -> Tuple[str, str]:
         """
         推断列的数据类型和语义类型
         
+        Args:
+            col_name: 列名
+            col_data: 列数据
+            non_null: 已过滤的非空值（可选，避免重复 dropna）
+            unique_count: 已计算的唯一值数（可选，避免重复 nunique）
+        
         Returns:
             (数据类型, 语义类型)
             数据类型: integer, decimal, text, date, boolean
             语义类型: id, category, date, integer, decimal, percentage, text
         """
         # 获取非空样本
-        non_null = col_data.dropna()
+        if non_null is None:
+            non_null = col_data.dropna()
         if len(non_null) == 0:
             return "text", "text"
         
@@ -187,7 +261,9 @@ class DataParser:
         
         # 分类 vs 文本
         unique_ratio = len(sample.unique()) / len(sample)
-        if unique_ratio < 0.5 or col_data.nunique() <= 100:
+        if unique_count is None:
+            unique_count = col_data.nunique()
+        if unique_ratio < 0.5 or unique_count <= 100:
             return "text", "category"
         
         return "text", "text"
@@ -217,19 +293,22 @@ class DataParser:
     def _get_sample_data(self, n: int = 5) -> List[Dict[str, Any]]:
         """获取样本数据"""
         sample_df = self.df.head(n)
-        records = []
-        for _, row in sample_df.iterrows():
-            record = {}
-            for col in self.df.columns:
-                value = row[col]
+        # 按列转换（避免 iterrows 逐行构造 Series），再按行拼装
+        converted = {}
+        for col in sample_df.columns:
+            values = []
+            for value in sample_df[col].tolist():
                 if pd.isna(value):
-                    record[col] = None
-                elif isinstance(value, (np.integer, np.floating)):
-                    record[col] = float(value) if isinstance(value, np.floating) else int(value)
+                    values.append(None)
+                elif isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+                    values.append(float(value) if isinstance(value, (float, np.floating)) else int(value))
                 else:
-                    record[col] = str(value)[:200]  # 限制长度
-            records.append(record)
-        return records
+                    values.append(str(value)[:200])  # 限制长度
+            converted[col] = values
+        return [
+            {col: converted[col][i] for col in sample_df.columns}
+            for i in range(len(sample_df))
+        ]
     
     def _generate_statistics(self) -> Dict[str, Any]:
         """生成整体统计信息"""
@@ -248,8 +327,9 @@ class DataParser:
         stats["text_columns"] = len(text_cols)
         
         # 检测可能的主键
+        row_count = len(self.df)
         for col in self.df.columns:
-            if self.df[col].nunique() == len(self.df) and self.df[col].isna().sum() == 0:
+            if self._unique_counts[col] == row_count and self._null_counts[col] == 0:
                 stats["potential_primary_key"] = col
                 break
         
@@ -3,10 +3,16 @@
 负责使用 LLM 生成字段描述和表描述
 """
 import json
+import asyncio
+import orjson
 from typing import Dict, List, Any, Optional
 from ..llm import llm_client
 
 
+async def _ignore_chunk(chunk: str, chunk_type: str):
+    """LLM 调用并发执行，不逐字打印流式输出（避免控制台交错），完成后整体打印"""
+
+
 class KnowledgeBuilder:
     """知识库构建器 - 使用 LLM 生成数据描述"""
     
@@ -47,6 +53,8 @@ class KnowledgeBuilder:
     MAX_FIELDS_FOR_LLM = 50
     # 每批处理的字段数量
     BATCH_SIZE = 10
+    # 同时进行的批次数量
+    MAX_CONCURRENT_BATCHES = 8
     
     def _format_field_info(self, col: Dict[str, Any]) -> str:
         """格式化单个字段信息用于批量 Prompt"""
@@ -101,20 +109,23 @@ class KnowledgeBuilder:
                 example_json=example_json
             )
             
-            print(f"\n{'='*60}")
             print(f"批量生成字段描述: 第 {batch_idx + 1}/{total_batches} 批 ({len(batch)} 个字段)")
-            print(f"字段: {', '.join(field_names)}")
-            print(f"{'='*60}")
-            print("LLM 输出:", flush=True)
             
-            result = await llm_client.chat_with_console_stream(
+            # 不需要逐 chunk 输出：普通模式走非流式请求，思考模式仍流式接收，均返回完整结果
+            result = await llm_client.chat(
                 messages=[{"role": "user", "content": prompt}],
                 agent_name="data",
-                prefix=">>> ",
+                chunk_callback=_ignore_chunk,
+                cache=True,
+                stream_hint=False,
             )
+            content = (result.get("content") or "").strip()
             
+            print(f"\n{'='*60}")
+            print(f"第 {batch_idx + 1}/{total_batches} 批字段: {', '.join(field_names)}")
             print(f"{'='*60}")
-            content = result.get("content", "").strip()
+            print(f"LLM 输出:\n>>> {content}")
+            print(f"{'='*60}", flush=True)
             
             # 解析 JSON（处理可能的 markdown 代码块）
             if "```json" in content:
@@ -122,7 +133,7 @@ class KnowledgeBuilder:
             elif "```" in content:
                 content = content.split("```")[1].split("```")[0]
             
-            parsed = json.loads(content.strip())
+            parsed = orjson.loads(content.strip())
             
             # 提取描述
             for name in field_names:
@@ -207,10 +218,19 @@ class KnowledgeBuilder:
         ]
         total_batches = len(batches)
         
-        print(f"开始批量生成字段描述: 共 {total} 个字段，分 {total_batches} 批处理（每批 {self.BATCH_SIZE} 个）")
+        print(f"开始批量生成字段描述: 共 {total} 个字段，分 {total_batches} 批并发处理（每批 {self.BATCH_SIZE} 个）")
+        
+        # 各批次互不依赖，并发调用 LLM（信号量限制同时进行的请求数）
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_BATCHES)
         
-        for batch_idx, batch in enumerate(batches):
-            batch_descriptions = await self._process_batch(batch, batch_idx, total_batches)
+        async def run_batch(batch_idx: int, batch: List[Dict[str, Any]]) -> Dict[str, str]:
+            async with semaphore:
+                return await self._process_batch(batch, batch_idx, total_batches)
+        
+        batch_results = await asyncio.gather(*[
+            run_batch(batch_idx, batch) for batch_idx, batch in enumerate(batches)
+        ])
+        for batch_descriptions in batch_results:
             descriptions.update(batch_descriptions)
         
         print(f"字段描述生成完成，共 {len(descriptions)} 个字段")
@@ -251,19 +271,21 @@ class KnowledgeBuilder:
                 fields_info="\n".join(fields_info),
             )
             
-            print(f"\n{'='*60}")
-            print(f"生成表描述: {table_name}")
-            print(f"{'='*60}")
-            print("LLM 输出:", flush=True)
-            
-            result = await llm_client.chat_with_console_stream(
+            # 与字段描述并发执行，同样整体打印输出
+            result = await llm_client.chat(
                 messages=[{"role": "user", "content": prompt}],
                 agent_name="data",
-                prefix=">>> ",
+                chunk_callback=_ignore_chunk,
+                cache=True,
+                stream_hint=False,
             )
+            content = (result.get("content") or "").strip()
             
+            print(f"\n{'='*60}")
+            print(f"生成表描述: {table_name}")
             print(f"{'='*60}")
-            content = result.get("content", "").strip()
+            print(f"LLM 输出:\n>>> {content}")
+            print(f"{'='*60}", flush=True)
             
             # 尝试解析 JSON
             # 处理可能的 markdown 代码块
@@ -272,7 +294,7 @@ class KnowledgeBuilder:
             elif "```" in content:
                 content = content.split("```")[1].split("```")[0]
             
-            return json.loads(content)
+            return orjson.loads(content)
             
         except json.JSONDecodeError as e:
             print(f"解析表描述失败: {e}")
@@ -319,22 +341,20 @@ class KnowledgeBuilder:
         }
         
         if generate_descriptions:
-            # 生成字段描述
-            field_descriptions = await self.generate_field_descriptions(
-                parsed_data["columns"]
+            # 字段描述与表描述互不依赖（表描述只用字段名 / 类型 / 样本），并发生成
+            field_descriptions, table_info = await asyncio.gather(
+                self.generate_field_descriptions(parsed_data["columns"]),
+                self.generate_table_description(
+                    knowledge["table_name"],
+                    knowledge["row_count"],
+                    knowledge["column_count"],
+                    knowledge["columns"],
+                ),
             )
             
             # 更新字段信息
             for col in knowledge["columns"]:
                 col["description"] = field_descriptions.get(col["name"], "")
-            
-            # 生成表描述
-            table_info = await self.generate_table_description(
-                knowledge["table_name"],
-                knowledge["row_count"],
-                knowledge["column_count"],
-                knowledge["columns"],
-            )
             knowledge["table_description"] = table_info
         else:
             # 使用默认描述
@@ -234,7 +234,7 @@ class ResearcherAgent:
             agent_type="research",
             agent_label=f"研究: {section_title[:20]}",
             session_id=session.session_id,
-            agent_id=agent_id or agent_event_manager.generate_agent_id("research"),
+            agent_id=agent_id or agent_event_manager.generate_agent_id("research", session.session_id),
         )
         
         print(f"\n{'='*60}")
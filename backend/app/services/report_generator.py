@@ -3,6 +3,7 @@
 基于对话内容和数据分析生成结构化报告
 """
 import json
+import asyncio
 from typing import Dict, List, Any, Optional, AsyncGenerator
 from datetime import datetime
 
@@ -106,13 +107,14 @@ class ReportGenerator:
         
         # 1. 创建报告
         yield {"type": "status", "message": "正在创建报告..."}
-        report = report_manager.create_report(
+        report = await asyncio.to_thread(
+            report_manager.create_report,
             session_id=session.session_id,
             title="数据分析报告",
         )
         report.source_questions.append(user_request)
         report.status = "generating"
-        report_manager.save_report(report)
+        await report_manager.save_report_async(report)
         
         yield {"type": "report_created", "report_id": report.report_id}
         
@@ -125,12 +127,12 @@ class ReportGenerator:
         if "error" in outline:
             yield {"type": "error", "message": outline["error"]}
             report.status = "error"
-            report_manager.save_report(report)
+            await report_manager.save_report_async(report)
             return
         
         report.title = outline.get("title", "数据分析报告")
         report.summary = outline.get("summary", "")
-        report_manager.save_report(report)
+        await report_manager.save_report_async(report)
         
         yield {"type": "outline", "data": outline}
         
@@ -194,7 +196,7 @@ class ReportGenerator:
             )
             
             report.sections.append(section)
-            report_manager.save_report(report)
+            await report_manager.save_report_async(report)
             
             yield {
                 "type": "section_complete",
@@ -204,7 +206,7 @@ class ReportGenerator:
         
         # 4. 完成
         report.status = "completed"
-        report_manager.save_report(report)
+        await report_manager.save_report_async(report)
         
         yield {"type": "complete", "report": report.model_dump()}
     
@@ -215,7 +217,8 @@ class ReportGenerator:
     ) -> Report:
         """同步生成报告"""
         
-        report = report_manager.create_report(
+        report = await asyncio.to_thread(
+            report_manager.create_report,
             session_id=session.session_id,
             title="数据分析报告",
         )
@@ -227,7 +230,7 @@ class ReportGenerator:
         
         if "error" in outline:
             report.status = "error"
-            report_manager.save_report(report)
+            await report_manager.save_report_async(report)
             return report
         
         report.title = outline.get("title", "数据分析报告")
@@ -277,7 +280,7 @@ class ReportGenerator:
             report.sections.append(section)
         
         report.status = "completed"
-        report_manager.save_report(report)
+        await report_manager.save_report_async(report)
         return report
     
     def _build_data_context(self, session: Session) -> str:
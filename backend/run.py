@@ -8,22 +8,6 @@ import logging
 from datetime import datetime
 from pathlib import Path
 
-# 修复 Windows 控制台编码问题
-if sys.platform == "win32":
-    os.system("chcp 65001 > nul 2>&1")
-    try:
-        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-        sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-    except Exception:
-        pass
-
-# 设置日志目录
-LOG_DIR = Path(__file__).parent.parent / "logs"
-LOG_DIR.mkdir(exist_ok=True)
-
-# 日志文件路径
-log_file = LOG_DIR / f"server_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-
 # 配置日志 - 同时输出到控制台和文件
 class TeeOutput:
     """同时输出到控制台和文件"""
@@ -47,11 +31,41 @@ class TeeOutput:
     def fileno(self):
         return self.stream.fileno()
 
-# 重定向输出
-sys.stdout = TeeOutput(log_file, sys.stdout)
-sys.stderr = TeeOutput(log_file, sys.stderr)
+
+def setup_console_and_logging() -> Path:
+    """
+    修复控制台编码，并把 stdout / stderr 同时输出到日志文件
+    只在作为启动脚本运行时调用：Windows 下进程池以 spawn 方式启动子进程时会重新导入本模块，
+    放在模块级会让每个子进程都新建日志文件并重定向输出
+    
+    Returns:
+        日志文件路径
+    """
+    # 修复 Windows 控制台编码问题
+    if sys.platform == "win32":
+        os.system("chcp 65001 > nul 2>&1")
+        try:
+            sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+            sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+        except Exception:
+            pass
+    
+    # 设置日志目录
+    log_dir = Path(__file__).parent.parent / "logs"
+    log_dir.mkdir(exist_ok=True)
+    
+    # 日志文件路径
+    log_file = log_dir / f"server_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    
+    # 重定向输出
+    sys.stdout = TeeOutput(log_file, sys.stdout)
+    sys.stderr = TeeOutput(log_file, sys.stderr)
+    return log_file
+
 
 if __name__ == "__main__":
+    log_file = setup_console_and_logging()
+    
     # 通过命令行参数控制是否启用热重载
     reload_mode = "--reload" in sys.argv or "-r" in sys.argv
     
@@ -16,6 +16,7 @@ const state = {
     tables: [],
     currentTable: null,
     pollingInterval: null,
+    statusStream: null,  // 上传状态 SSE 连接
     // 报告相关
     reports: [],
     currentReport: null,
@@ -539,12 +540,59 @@ function formatStartTime(isoString) {
     }
 }
 
-function startPollingStatus() {
-    // 清除已有的轮询
+function stopStatusUpdates() {
+    if (state.statusStream) {
+        state.statusStream.close();
+        state.statusStream = null;
+    }
     if (state.pollingInterval) {
         clearInterval(state.pollingInterval);
+        state.pollingInterval = null;
     }
+}
+
+function startPollingStatus() {
+    stopStatusUpdates();
     
+    // 浏览器支持时使用 SSE，仅在状态变化时推送；否则退回轮询
+    if (typeof EventSource === 'undefined') {
+        startStatusPolling();
+        return;
+    }
+    
+    const stream = new EventSource(`${API_BASE}/upload/stream/${state.sessionId}`);
+    state.statusStream = stream;
+    const files = new Map();  // file_id -> 状态，保持上传顺序
+    
+    stream.onmessage = async (e) => {
+        if (e.data === '[DONE]') {
+            stopStatusUpdates();
+            await loadKnowledgeBase();
+            return;
+        }
+        const data = JSON.parse(e.data);
+        if (data.type === 'status') {
+            files.clear();
+            data.files.forEach(f => files.set(f.file_id, f));
+        } else if (data.type === 'files') {
+            data.files.forEach(f => files.set(f.file_id, f));
+            data.removed.forEach(id => files.delete(id));
+        } else {
+            return;  // heartbeat
+        }
+        renderFileStatus([...files.values()]);
+    };
+    
+    stream.onerror = () => {
+        // 连接异常时退回轮询
+        if (state.statusStream === stream) {
+            stopStatusUpdates();
+            startStatusPolling();
+        }
+    };
+}
+
+function startStatusPolling() {
     // 每1秒轮询一次（处理中时需要更频繁更新进度）
     state.pollingInterval = setInterval(async () => {
         try {
@@ -625,11 +673,8 @@ async function clearAll() {
     try {
         await apiCall(`/session/${state.sessionId}/clear`, { method: 'DELETE' });
         
-        // 停止轮询
-        if (state.pollingInterval) {
-            clearInterval(state.pollingInterval);
-            state.pollingInterval = null;
-        }
+        // 停止状态更新
+        stopStatusUpdates();
         
         // 清空状态
         state.tables = [];
@@ -648,11 +693,8 @@ async function clearAll() {
 async function newSession() {
     if (!confirm('确定要开始新会话吗？当前会话的所有数据将保留，但不再显示。')) return;
     
-    // 停止轮询
-    if (state.pollingInterval) {
-        clearInterval(state.pollingInterval);
-        state.pollingInterval = null;
-    }
+    // 停止状态更新
+    stopStatusUpdates();
     
     // 清除会话
     state.sessionId = null;
@@ -3123,7 +3165,7 @@ function appendAgentLog(agentId, logEntry) {
             dataHtml = `
                 <div class="log-data log-data-expandable">
                     <div class="log-summary" onclick="toggleLogData(this)">
-                        📨 消息数: ${msgCount} <span class="expand-hint">[点击展开]</span>
+                        📨 消息数: ${msgCount}${logEntry.data.start_index ? ` (新增 ${messages.length})` : ''} <span class="expand-hint">[点击展开]</span>
                     </div>
                     <div class="log-messages-list" style="display: none;">
                         ${messages.map(m => `